@@ -1,46 +1,297 @@
 import os
 import re
 import io
-from datetime import datetime
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+import csv
+import glob
+import html
+import json
+import math
+import random
+import mimetypes
+import mmap
+import time
+import hashlib
+import uuid
+import sqlite3
+import tempfile
+import threading
+import zlib
+import click
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial, wraps
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
+from flask import Flask, Request, request, jsonify, render_template, redirect, url_for, Response, stream_with_context, g, has_request_context, session
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text, tuple_, func, case
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from werkzeug.utils import secure_filename
-import PyPDF2
-from PIL import Image
-import pytesseract
 import requests
+from requests.adapters import HTTPAdapter
+import prometheus_client
+from prometheus_client import multiprocess
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+def database_uri():
+    uri = os.environ.get('DATABASE_URL', 'sqlite:///chatbot.db')
+    # Heroku still hands out postgres:// URLs, which SQLAlchemy 2 no longer accepts
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
 # Initialize Flask app
 app = Flask(__name__, static_folder='static')
 app.config.update(
     SECRET_KEY=os.environ.get('SECRET_KEY', 'dev-secret-key'),
-    SQLALCHEMY_DATABASE_URI=os.environ.get('DATABASE_URL', 'sqlite:///chatbot.db'),
+    SQLALCHEMY_DATABASE_URI=database_uri(),
     SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    # Database connections kept open per worker process; like GEMINI_POOL_SIZE, match gunicorn's thread count
+    DB_POOL_SIZE=int(os.environ.get('DB_POOL_SIZE', os.environ.get('GUNICORN_THREADS', 8))),
+    DB_MAX_OVERFLOW=int(os.environ.get('DB_MAX_OVERFLOW', 4)),
+    DB_POOL_TIMEOUT=int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    DB_POOL_RECYCLE=int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    # SQLite pragmas set on every new connection. WAL lets readers run during a write, and
+    # synchronous=NORMAL only syncs at checkpoints (still safe from corruption in WAL mode)
+    SQLITE_JOURNAL_MODE=os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    SQLITE_SYNCHRONOUS=os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    # Milliseconds a writer waits for the write lock before "database is locked"
+    SQLITE_BUSY_TIMEOUT=int(os.environ.get('SQLITE_BUSY_TIMEOUT', 15000)),
+    SQLITE_CACHE_SIZE_MB=int(os.environ.get('SQLITE_CACHE_SIZE_MB', 64)),
+    SQLITE_MMAP_SIZE_MB=int(os.environ.get('SQLITE_MMAP_SIZE_MB', 256)),
     MAX_CONTENT_LENGTH=512* 1024 * 1024,
-    UPLOAD_FOLDER=os.path.join(os.path.abspath(os.path.dirname(__file__)), 'user_uploads'),
+    UPLOAD_FOLDER=os.environ.get('UPLOAD_FOLDER', os.path.join(os.path.abspath(os.path.dirname(__file__)), 'user_uploads')),
     ALLOWED_EXTENSIONS={'pdf', 'png', 'jpg', 'jpeg', 'gif', 'webp'},
     SESSION_COOKIE_SECURE=True,
     SESSION_COOKIE_HTTPONLY=True,
-    SESSION_COOKIE_SAMESITE='Lax'
+    SESSION_COOKIE_SAMESITE='Lax',
+    GEMINI_API_BASE=os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com/v1'),
+    GEMINI_MODEL=os.environ.get('GEMINI_MODEL', 'gemini-1.5-flash'),
+    GEMINI_TIMEOUT=int(os.environ.get('GEMINI_TIMEOUT', 30)),
+    # Keep-alive connections held open to Gemini per worker process; match it to gunicorn's thread count
+    GEMINI_POOL_SIZE=int(os.environ.get('GEMINI_POOL_SIZE', os.environ.get('GUNICORN_THREADS', 8))),
+    # Retries of 429/5xx answers and dropped connections, with jittered exponential backoff from
+    # GEMINI_RETRY_BASE seconds; a Retry-After longer than GEMINI_RETRY_MAX_DELAY fails at once instead
+    GEMINI_MAX_RETRIES=int(os.environ.get('GEMINI_MAX_RETRIES', 2)),
+    GEMINI_RETRY_BASE=float(os.environ.get('GEMINI_RETRY_BASE', 0.5)),
+    GEMINI_RETRY_MAX_DELAY=float(os.environ.get('GEMINI_RETRY_MAX_DELAY', 8)),
+    # After this many failed calls in a row a worker stops calling Gemini for GEMINI_BREAKER_COOLDOWN seconds (0 turns it off)
+    GEMINI_BREAKER_THRESHOLD=int(os.environ.get('GEMINI_BREAKER_THRESHOLD', 5)),
+    GEMINI_BREAKER_COOLDOWN=float(os.environ.get('GEMINI_BREAKER_COOLDOWN', 30)),
+    # Gemini calls in flight per worker, overall and per user; extra calls wait up to GEMINI_QUEUE_TIMEOUT seconds
+    GEMINI_MAX_CONCURRENCY=int(os.environ.get('GEMINI_MAX_CONCURRENCY', os.environ.get('GEMINI_POOL_SIZE', os.environ.get('GUNICORN_THREADS', 8)))),
+    GEMINI_USER_CONCURRENCY=int(os.environ.get('GEMINI_USER_CONCURRENCY', 2)),
+    GEMINI_QUEUE_TIMEOUT=float(os.environ.get('GEMINI_QUEUE_TIMEOUT', 5)),
+    AI_CACHE_BACKEND=os.environ.get('AI_CACHE_BACKEND', 'memory'),  # memory, sqlite or none
+    AI_CACHE_TTL=int(os.environ.get('AI_CACHE_TTL', 3600)),
+    AI_CACHE_MAX_ENTRIES=int(os.environ.get('AI_CACHE_MAX_ENTRIES', 1000)),
+    AI_CACHE_PATH=os.environ.get('AI_CACHE_PATH', os.path.join(app.instance_path, 'ai_cache.db')),
+    # Run PDF/OCR extraction in a process pool instead of inside the upload request
+    ASYNC_EXTRACTION=os.environ.get('ASYNC_EXTRACTION', 'true').lower() == 'true',
+    EXTRACTION_WORKERS=int(os.environ.get('EXTRACTION_WORKERS', 2)),
+    # Uploads allowed to wait or run in the pool at once per worker; beyond this uploads get a 503
+    EXTRACTION_QUEUE_SIZE=int(os.environ.get('EXTRACTION_QUEUE_SIZE', 8)),
+    # A blob still pending this long after it was queued (its worker died or restarted) is extracted again on re-upload
+    EXTRACTION_STALE_SECONDS=int(os.environ.get('EXTRACTION_STALE_SECONDS', 1800)),
+    # PDFs are split into page ranges of at least this size and extracted in parallel
+    PDF_PAGES_PER_TASK=int(os.environ.get('PDF_PAGES_PER_TASK', 25)),
+    # Images are rotated per EXIF, grayscaled, binarized and scaled to this DPI (when they record one) before OCR
+    OCR_TARGET_DPI=int(os.environ.get('OCR_TARGET_DPI', 300)),
+    TESSERACT_CMD=os.environ.get('TESSERACT_CMD', '/usr/bin/tesseract'),
+    # Larger images are scaled down to this many pixels; images over OCR_TILE_PIXELS are split into
+    # overlapping horizontal bands with OCR_TILE_THREADS Tesseract processes running at once
+    OCR_MAX_PIXELS=int(os.environ.get('OCR_MAX_PIXELS', 40_000_000)),
+    OCR_TILE_PIXELS=int(os.environ.get('OCR_TILE_PIXELS', 4_000_000)),
+    OCR_TILE_OVERLAP=int(os.environ.get('OCR_TILE_OVERLAP', 100)),
+    OCR_TILE_THREADS=int(os.environ.get('OCR_TILE_THREADS', 4)),
+    # Square avatar thumbnails (px) written as WebP and JPEG after an avatar upload
+    AVATAR_SIZES=[int(size) for size in os.environ.get('AVATAR_SIZES', '48,96,192').split(',')],
+    # Frames read from animated GIF/WebP files; repeated frames are only OCR'd once
+    OCR_MAX_FRAMES=int(os.environ.get('OCR_MAX_FRAMES', 10)),
+    # File context sent to Gemini: whole text up to the budget, otherwise the best matching chunks
+    RETRIEVAL_CONTEXT_CHARS=int(os.environ.get('RETRIEVAL_CONTEXT_CHARS', 8000)),
+    RETRIEVAL_TOP_K=int(os.environ.get('RETRIEVAL_TOP_K', 8)),
+    RETRIEVAL_CHUNK_CHARS=int(os.environ.get('RETRIEVAL_CHUNK_CHARS', 1000)),
+    RETRIEVAL_CHUNK_OVERLAP=int(os.environ.get('RETRIEVAL_CHUNK_OVERLAP', 150)),
+    # Rows fetched per query while streaming /api/chats/export
+    EXPORT_BATCH_SIZE=int(os.environ.get('EXPORT_BATCH_SIZE', 500)),
+    # Seconds /api/profile and /api/user/stats payloads are reused per worker before rebuilding
+    USER_STATS_CACHE_TTL=int(os.environ.get('USER_STATS_CACHE_TTL', 30)),
+    # Seconds a worker keeps a user's record for the login loader instead of reading the row each request
+    USER_CACHE_TTL=int(os.environ.get('USER_CACHE_TTL', 60)),
+    # Conversation history sent with each message: rolling summary plus recent turns, in estimated tokens
+    CONVERSATION_TOKEN_BUDGET=int(os.environ.get('CONVERSATION_TOKEN_BUDGET', 2000)),
+    # Turns kept verbatim; older ones are folded into the summary once SUMMARY_EVERY more have piled up
+    CONVERSATION_RECENT_TURNS=int(os.environ.get('CONVERSATION_RECENT_TURNS', 6)),
+    CONVERSATION_SUMMARY_EVERY=int(os.environ.get('CONVERSATION_SUMMARY_EVERY', 4)),
+    CONVERSATION_SUMMARY_CHARS=int(os.environ.get('CONVERSATION_SUMMARY_CHARS', 2000)),
+    # Log requests slower than this many seconds with a per-stage breakdown (0 turns it off)
+    SLOW_REQUEST_SECONDS=float(os.environ.get('SLOW_REQUEST_SECONDS', 0)),
+    # When set, GET /metrics requires `Authorization: Bearer <token>`
+    METRICS_TOKEN=os.environ.get('METRICS_TOKEN'),
+    # Who pushes the bytes of uploaded files: '' (the worker), 'x-accel' (nginx) or 'x-sendfile' (Apache, lighttpd)
+    MEDIA_OFFLOAD=os.environ.get('MEDIA_OFFLOAD', '').lower(),
+    USE_X_SENDFILE=os.environ.get('MEDIA_OFFLOAD', '').lower() == 'x-sendfile',
+    # nginx `internal` location aliased to UPLOAD_FOLDER, for MEDIA_OFFLOAD=x-accel
+    MEDIA_ACCEL_PREFIX=os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/'),
+    # Browser cache lifetime of fingerprinted static files (?v=<hash>) and uploaded avatars
+    STATIC_MAX_AGE=int(os.environ.get('STATIC_MAX_AGE', 365 * 24 * 3600))
 )
 
+def engine_options(uri):
+    """Pool settings for the configured database"""
+    if uri.startswith('sqlite'):
+        if ':memory:' in uri or uri.rstrip('/') == 'sqlite:':
+            return {}
+        # check_same_thread: pooled connections are handed between gunicorn threads
+        return {
+            'pool_size': app.config['DB_POOL_SIZE'],
+            'max_overflow': app.config['DB_MAX_OVERFLOW'],
+            'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+            'connect_args': {'timeout': app.config['SQLITE_BUSY_TIMEOUT'] / 1000, 'check_same_thread': False},
+        }
+    # Server databases: drop connections the server or a proxy may have closed while idle
+    return {
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+def apply_sqlite_pragmas(conn):
+    """Tune a new sqlite3 connection per the SQLITE_* settings"""
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}")
+    cursor.execute(f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT']}")
+    cursor.execute(f"PRAGMA cache_size={-app.config['SQLITE_CACHE_SIZE_MB'] * 1024}")
+    cursor.execute(f"PRAGMA mmap_size={app.config['SQLITE_MMAP_SIZE_MB'] * 1024 * 1024}")
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        apply_sqlite_pragmas(dbapi_connection)
+
 # Initialize extensions
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 CORS(app, supports_credentials=True, resources={r"/*": {"origins": os.environ.get('ALLOWED_ORIGINS', 'http://localhost:3000')}})
 
-# Optional: Configure Tesseract path
-try:
-    pytesseract.pytesseract.tesseract_cmd = os.environ.get('TESSERACT_CMD', '/usr/bin/tesseract')
-except:
-    print("Tesseract OCR not configured properly")
+# Shared keep-alive HTTP client for Gemini, so each AI call reuses a pooled TLS connection
+gemini_session = requests.Session()
+gemini_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=app.config['GEMINI_POOL_SIZE']))
+gemini_session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=app.config['GEMINI_POOL_SIZE']))
+
+# ========== METRICS ==========
+# With PROMETHEUS_MULTIPROC_DIR set (gunicorn.conf.py does this), every worker writes its
+# samples to files in that directory and /metrics adds them up across processes.
+REQUEST_LATENCY = prometheus_client.Histogram(
+    'echobot_request_duration_seconds', 'Time to handle an HTTP request, including streamed bodies', ['method', 'route'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+REQUESTS = prometheus_client.Counter('echobot_requests', 'HTTP requests by route and status', ['method', 'route', 'status'])
+STAGE_LATENCY = prometheus_client.Histogram(
+    'echobot_stage_duration_seconds', 'Time spent in one stage: gemini, gemini_stream, gemini_queue, pdf_extraction, ocr, upload_save, db',
+    ['stage'], buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+)
+GEMINI_RESPONSES = prometheus_client.Counter('echobot_gemini_responses', 'Gemini upstream responses by HTTP status or error', ['status'])
+GEMINI_RETRIES = prometheus_client.Counter('echobot_gemini_retries', 'Gemini calls repeated after a 429/5xx answer or dropped connection')
+GEMINI_REJECTED = prometheus_client.Counter(
+    'echobot_gemini_rejected', 'Gemini calls refused without reaching the upstream: circuit_open, user_limit or global_limit', ['reason']
+)
+DB_QUERIES = prometheus_client.Histogram(
+    'echobot_db_queries_per_request', 'SQL statements executed per HTTP request', buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250)
+)
+UPLOAD_BYTES = prometheus_client.Counter('echobot_upload_bytes', 'Bytes received in file uploads')
+
+def record_stage(stage, seconds):
+    """Observe a stage duration and add it to the current request's breakdown"""
+    STAGE_LATENCY.labels(stage).observe(seconds)
+    if has_request_context() and 'request_metrics' in g:
+        g.request_metrics['stages'][stage] += seconds
+
+@contextmanager
+def timed_stage(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    # Summed per request and observed once in finish_request_metrics
+    if has_request_context() and 'request_metrics' in g:
+        g.request_metrics['stages']['db'] += elapsed
+        g.request_metrics['db_queries'] += 1
+
+@app.before_request
+def start_request_metrics():
+    g.request_metrics = {'started': time.perf_counter(), 'stages': defaultdict(float), 'db_queries': 0, 'upload_bytes': None}
+
+@app.after_request
+def schedule_request_metrics(response):
+    """Record the request when the server closes the response, so streamed bodies are included"""
+    if 'request_metrics' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        response.call_on_close(partial(
+            finish_request_metrics, g.request_metrics, request.method, route, request.path, response.status_code
+        ))
+    return response
+
+def finish_request_metrics(metrics, method, route, path, status):
+    elapsed = time.perf_counter() - metrics['started']
+    stages = metrics['stages']
+    REQUEST_LATENCY.labels(method, route).observe(elapsed)
+    REQUESTS.labels(method, route, str(status)).inc()
+    DB_QUERIES.observe(metrics['db_queries'])
+    if metrics['db_queries']:
+        STAGE_LATENCY.labels('db').observe(stages['db'])
+
+    slow_after = app.config['SLOW_REQUEST_SECONDS']
+    if slow_after and elapsed >= slow_after:
+        breakdown = [f"db {stages['db']:.3f}s/{metrics['db_queries']} queries"]
+        breakdown += [f"{stage} {seconds:.3f}s" for stage, seconds in sorted(stages.items()) if stage != 'db']
+        if metrics['upload_bytes'] is not None:
+            breakdown.append(f"upload {metrics['upload_bytes']} B")
+        print(f"Slow request: {method} {path} {status} {elapsed:.3f}s ({', '.join(breakdown)})")
+
+def metrics_registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return prometheus_client.REGISTRY
+    registry = prometheus_client.CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of the counters and histograms above"""
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(prometheus_client.generate_latest(metrics_registry()), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
 
 # ========== ROUTES FOR PAGES ==========
 @app.route('/')
@@ -67,12 +318,23 @@ class User(UserMixin, db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
     avatar = db.Column(db.String(255), default='/static/Avatar.jpeg')
+    avatar_sizes = db.Column(db.String(64))  # comma-separated thumbnail sizes of the current avatar, NULL until made
     theme = db.Column(db.String(20), default='light')
     notifications = db.Column(db.Boolean, default=True)
     language = db.Column(db.String(20), default='English')
     joined_date = db.Column(db.DateTime, default=datetime.utcnow)
+    # Denormalized counters kept in step with chat/uploaded_file writes; NULL until first computed
+    total_chats = db.Column(db.Integer, default=0)
+    total_files = db.Column(db.Integer, default=0)
+    latest_chat_at = db.Column(db.DateTime)
+    # Bumped by every profile or avatar change; sessions carry it so workers know when their cached copy is old
+    version = db.Column(db.Integer, default=0)
     chats = db.relationship('Chat', backref='user', lazy=True, cascade='all, delete-orphan')
     files = db.relationship('UploadedFile', backref='user', lazy=True, cascade='all, delete-orphan')
+    conversations = db.relationship('Conversation', lazy=True, cascade='all, delete-orphan')
+
+    def get_id(self):
+        return f"{self.id}:{self.version or 0}"
 
 class Chat(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -80,20 +342,179 @@ class Chat(db.Model):
     user_message = db.Column(db.Text, nullable=False)
     ai_message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    conversation_id = db.Column(db.String(36))  # None for chats saved outside a conversation
+
+# Serves every per-user, newest-first listing and its keyset cursor
+db.Index('ix_chat_user_id_timestamp_id', Chat.user_id, Chat.timestamp.desc(), Chat.id.desc())
+db.Index('ix_chat_conversation_id_id', Chat.conversation_id, Chat.id)
+
+class Conversation(db.Model):
+    """A thread of chats plus a rolling summary of the turns that no longer fit in the prompt"""
+    id = db.Column(db.String(36), primary_key=True)  # UUID, also stored on each Chat
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    summary = db.Column(db.Text)
+    summarized_through = db.Column(db.Integer, default=0)  # id of the last Chat folded into the summary
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Characters of extracted text kept uncompressed for file listings
+TEXT_PREVIEW_CHARS = 500
+
+class FileBlob(db.Model):
+    """Content-addressed upload shared by every UploadedFile with the same bytes.
+
+    Extraction runs once per blob, so re-uploads and shared handouts reuse its text.
+    """
+    sha256 = db.Column(db.String(64), primary_key=True)
+    filepath = db.Column(db.String(512), nullable=False)
+    filetype = db.Column(db.String(50), nullable=False)
+    filesize = db.Column(db.Integer, nullable=False)
+    # Uncompressed text written before BlobText existed; `flask compact-file-text` moves it out
+    legacy_text = db.deferred(db.Column('extracted_text', db.Text))
+    preview = db.Column(db.Text)  # first TEXT_PREVIEW_CHARS characters, for listings
+    text_length = db.Column(db.Integer)
+    status = db.Column(db.String(20), default='pending')  # pending, ready or failed
+    page_count = db.Column(db.Integer)
+    pages_done = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    queued_at = db.Column(db.DateTime, default=datetime.utcnow)  # when the current extraction was queued
+    chunk_count = db.Column(db.Integer)  # set once the retrieval index is built
+    avg_chunk_length = db.Column(db.Float)
+    pages = db.relationship('BlobPage', backref='blob', lazy=True, cascade='all, delete-orphan')
+    chunks = db.relationship('BlobChunk', lazy=True, cascade='all, delete-orphan')
+    terms = db.relationship('BlobTerm', lazy=True, cascade='all, delete-orphan')
+    text_row = db.relationship('BlobText', uselist=False, lazy=True, cascade='all, delete-orphan')
+
+    @property
+    def extracted_text(self):
+        """Full text, decompressed on access; listings should use preview/text_length"""
+        if self.text_row is not None:
+            return zlib.decompress(self.text_row.data).decode('utf-8')
+        return self.legacy_text
+
+    @extracted_text.setter
+    def extracted_text(self, value):
+        self.legacy_text = None
+        if value is None:
+            self.text_row = None
+            self.preview = self.text_length = None
+            return
+        data = zlib.compress(value.encode('utf-8'), 6)
+        if self.text_row is None:
+            self.text_row = BlobText(data=data)
+        else:
+            self.text_row.data = data
+        self.preview = value[:TEXT_PREVIEW_CHARS]
+        self.text_length = len(value)
+
+class BlobText(db.Model):
+    """zlib-compressed extracted text of a blob, kept out of file_blob so row loads stay small"""
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('file_blob.sha256'), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+class BlobPage(db.Model):
+    """Text of a single PDF page, so page boundaries survive extraction"""
+    id = db.Column(db.Integer, primary_key=True)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('file_blob.sha256'), nullable=False)
+    page_number = db.Column(db.Integer, nullable=False)  # 1-based
+    text = db.Column(db.Text, nullable=False, default='')
+    __table_args__ = (db.Index('ix_blob_page_blob_sha256_page_number', 'blob_sha256', 'page_number', unique=True),)
+
+class BlobChunk(db.Model):
+    """A retrieval chunk of a blob's text, at most RETRIEVAL_CHUNK_CHARS long"""
+    id = db.Column(db.Integer, primary_key=True)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('file_blob.sha256'), nullable=False)
+    chunk_index = db.Column(db.Integer, nullable=False)
+    page_number = db.Column(db.Integer)  # None for images
+    text = db.Column(db.Text, nullable=False)
+    __table_args__ = (db.Index('ix_blob_chunk_blob_sha256_chunk_index', 'blob_sha256', 'chunk_index', unique=True),)
+
+class BlobTerm(db.Model):
+    """Inverted index entry: JSON postings [[chunk_index, term_frequency, chunk_length], ...]"""
+    id = db.Column(db.Integer, primary_key=True)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('file_blob.sha256'), nullable=False)
+    term = db.Column(db.String(64), nullable=False)
+    postings = db.Column(db.Text, nullable=False)
+    __table_args__ = (db.Index('ix_blob_term_blob_sha256_term', 'blob_sha256', 'term', unique=True),)
 
 class UploadedFile(db.Model):
+    """A user's reference to an uploaded blob under the filename they chose"""
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
     filepath = db.Column(db.String(512), nullable=False)
     filetype = db.Column(db.String(50), nullable=False)
     filesize = db.Column(db.Integer, nullable=False)
-    extracted_text = db.Column(db.Text)
+    # Text of uploads stored before content addressing; newer rows read it from their blob and
+    # `flask compact-file-text` moves these into one
+    legacy_text = db.deferred(db.Column('extracted_text', db.Text))
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('file_blob.sha256'), index=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    blob = db.relationship('FileBlob', lazy='joined')
+
+    @property
+    def extracted_text(self):
+        return self.blob.extracted_text if self.blob else self.legacy_text
+
+    @property
+    def preview(self):
+        if self.blob is None:
+            return (self.legacy_text or '')[:TEXT_PREVIEW_CHARS]
+        if self.blob.preview is None and self.blob.legacy_text:
+            return self.blob.legacy_text[:TEXT_PREVIEW_CHARS]
+        return self.blob.preview
+
+    @property
+    def text_length(self):
+        if self.blob is None:
+            return len(self.legacy_text or '')
+        if self.blob.text_length is None and self.blob.legacy_text:
+            return len(self.blob.legacy_text)
+        return self.blob.text_length or 0
+
+    @property
+    def status(self):
+        return self.blob.status if self.blob else 'ready'
+
+    @property
+    def page_count(self):
+        return self.blob.page_count if self.blob else None
+
+    @property
+    def pages_done(self):
+        return self.blob.pages_done if self.blob else None
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    # Session ids are "<id>:<version>"; a bare "<id>" is a session from before versions existed
+    user_id, _, version = user_id.partition(':')
+    user_id, version = int(user_id), int(version) if version else None
+    snapshot = user_cache.get(user_id)
+    if snapshot is not None and (snapshot.version or 0) == version:
+        return db.session.merge(snapshot, load=False)
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    user_cache.set(user_id, user_snapshot(user))
+    if (user.version or 0) != version:
+        # Changed through another session since this one last saw it
+        session['_user_id'] = user.get_id()
+    return user
+
+def live_user_required(view):
+    """For routes that add rows owned by current_user.
+
+    load_user can serve a cached copy of an account that was just deleted through another
+    worker, so check the row still exists before writing anything that points at it.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = current_user.id
+        if not db.session.query(db.exists().where(User.id == user_id)).scalar():
+            user_cache.delete(user_id)
+            logout_user()
+            return jsonify({'error': 'Account no longer exists'}), 401
+        return view(*args, **kwargs)
+    return wrapper
 # ========== HELPER FUNCTIONS ==========    
 
 def allowed_file(filename):
@@ -105,29 +526,1166 @@ def validate_email(email):
 def validate_username(username):
     return re.match(r"^[a-zA-Z0-9_-]{3,32}$", username)
 
-def extract_text_from_pdf(file_stream):
+@contextmanager
+def open_pdf(filepath):
+    """PdfReader over a read-only mmap of the file.
+
+    Given a path, PyPDF2 reads the whole file into a BytesIO, once per page-range task.
+    """
+    import PyPDF2
+    with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        yield PyPDF2.PdfReader(view)
+
+def extract_pdf_page_range(filepath, start, stop):
+    """Extract the text of pages [start, stop) of a PDF. Runs in the extraction pool"""
+    with open_pdf(filepath) as reader:
+        return [reader.pages[i].extract_text() or '' for i in range(start, stop)]
+
+def count_pdf_pages(filepath):
+    with open_pdf(filepath) as reader:
+        return len(reader.pages)
+
+def pdf_page_ranges(page_count):
+    """Split a PDF into about two ranges per pool process.
+
+    Every range re-parses the page tree, so ranges never shrink below PDF_PAGES_PER_TASK.
+    """
+    target_tasks = app.config['EXTRACTION_WORKERS'] * 2
+    size = max(app.config['PDF_PAGES_PER_TASK'], -(-page_count // target_tasks))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+def join_pdf_pages(pages):
+    text = '\n'.join(pages)
+    return text.strip() or '[No extractable text found in PDF]'
+
+def image_frames(image):
+    """The frames of an animated GIF/WebP (up to OCR_MAX_FRAMES), or just the image"""
+    from PIL import ImageSequence
+    if getattr(image, 'n_frames', 1) == 1:
+        yield image
+        return
+    for number, frame in enumerate(ImageSequence.Iterator(image)):
+        if number >= app.config['OCR_MAX_FRAMES']:
+            return
+        yield frame
+
+def otsu_threshold(histogram):
+    """Gray level that best separates text from background in a 256-bin histogram"""
+    total = sum(histogram)
+    total_sum = sum(level * count for level, count in enumerate(histogram))
+    weight = level_sum = 0
+    best, threshold = -1, 127
+    for level, count in enumerate(histogram):
+        weight += count
+        if weight == 0:
+            continue
+        if weight == total:
+            break
+        level_sum += level * count
+        mean_low = level_sum / weight
+        mean_high = (total_sum - level_sum) / (total - weight)
+        between = weight * (total - weight) * (mean_low - mean_high) ** 2
+        if between > best:
+            best, threshold = between, level
+    return threshold
+
+def prepare_ocr_image(image):
+    """Upright, grayscale, binarized copy of an image at roughly OCR_TARGET_DPI"""
+    from PIL import Image, ImageOps
+    dpi = image.info.get('dpi', (0, 0))[0]
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        # Transparent backgrounds become white rather than black
+        image = Image.alpha_composite(Image.new('RGBA', image.size, 'white'), image.convert('RGBA'))
+    image = image.convert('L')
+
+    # 72/96 dpi is a screen or camera default rather than a scan resolution, so only trust higher values
+    scale = app.config['OCR_TARGET_DPI'] / dpi if 100 <= dpi <= 2400 else 1.0
+    scale = min(scale, math.sqrt(app.config['OCR_MAX_PIXELS'] / (image.width * image.height)))
+    if abs(scale - 1) > 0.05:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.Resampling.LANCZOS if scale > 1 else Image.Resampling.BILINEAR, reducing_gap=2.0 if scale < 1 else None)
+
+    threshold = otsu_threshold(image.histogram())
+    return image.point([0] * (threshold + 1) + [255] * (255 - threshold))
+
+def ocr_band_boxes(width, height):
+    """Full-width bands of about OCR_TILE_PIXELS each, overlapping so no text line is only ever seen cut"""
+    overlap = app.config['OCR_TILE_OVERLAP']
+    band_height = max(app.config['OCR_TILE_PIXELS'] // width, overlap * 4)
+    if band_height >= height:
+        return [(0, 0, width, height)]
+    boxes = []
+    top = 0
+    while True:
+        bottom = min(top + band_height, height)
+        boxes.append((0, top, width, bottom))
+        if bottom == height:
+            return boxes
+        top = bottom - overlap
+
+def merge_band_text(texts):
+    """Join band texts, dropping lines repeated from the overlap with the previous band"""
+    merged = []
+    for band_text in texts:
+        lines = [line.rstrip() for line in band_text.splitlines() if line.strip()]
+        repeated = next((k for k in range(min(len(merged), len(lines), 3), 0, -1) if merged[-k:] == lines[:k]), 0)
+        merged.extend(lines[repeated:])
+    return '\n'.join(merged)
+
+def load_pytesseract():
+    """pytesseract, imported on the first OCR and pointed at TESSERACT_CMD"""
+    import pytesseract
+    pytesseract.pytesseract.tesseract_cmd = app.config['TESSERACT_CMD']
+    return pytesseract
+
+def ocr_image(image):
+    """OCR a prepared image, in parallel bands when it is large"""
+    pytesseract = load_pytesseract()
+    boxes = ocr_band_boxes(image.width, image.height)
+    if len(boxes) == 1:
+        return pytesseract.image_to_string(image)
+    # Each band is its own Tesseract process; stop them also spreading over every core
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+    with ThreadPoolExecutor(max_workers=min(app.config['OCR_TILE_THREADS'], len(boxes))) as pool:
+        texts = list(pool.map(pytesseract.image_to_string, (image.crop(box) for box in boxes)))
+    return merge_band_text(texts)
+
+def extract_text_from_image(file_stream):
+    """OCR every distinct frame. Errors propagate so the caller can mark the blob failed"""
+    from PIL import Image
+    texts, seen = [], set()
+    with Image.open(file_stream) as image:
+        for frame in image_frames(image):
+            prepared = prepare_ocr_image(frame)
+            digest = hashlib.sha1(prepared.tobytes()).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            texts.append(ocr_image(prepared).strip())
+    text = '\n\n'.join(t for t in texts if t)
+    return text or '[No text found in image]'
+
+def extract_text_from_image_file(filepath):
+    # PIL reads from the path as it decodes instead of needing the file in memory
+    return extract_text_from_image(filepath)
+
+def store_pdf_pages(sha256, start, pages):
+    """Save one extracted page range and advance the blob's progress counter"""
+    db.session.add_all([
+        BlobPage(blob_sha256=sha256, page_number=start + offset + 1, text=page_text)
+        for offset, page_text in enumerate(pages)
+    ])
+    db.session.execute(
+        db.update(FileBlob)
+        .where(FileBlob.sha256 == sha256)
+        .values(pages_done=db.func.coalesce(FileBlob.pages_done, 0) + len(pages))
+    )
+    db.session.commit()
+
+def complete_pdf_extraction(blob, error=None):
+    """Assemble extracted_text from the stored pages once every range is done"""
+    if error is not None:
+        blob.extracted_text = f'[Error extracting PDF text: {str(error)}]'
+        blob.status = 'failed'
+    else:
+        pages = db.session.execute(
+            db.select(BlobPage.text).filter_by(blob_sha256=blob.sha256).order_by(BlobPage.page_number)
+        ).scalars()
+        blob.extracted_text = join_pdf_pages(pages)
+        blob.status = 'ready'
+    db.session.commit()
+    if blob.status == 'ready':
+        index_blob(blob)
+
+def extract_blob_inline(blob):
+    """Extract text inside the request when ASYNC_EXTRACTION is off"""
+    if blob.filetype != 'pdf':
+        try:
+            with timed_stage('ocr'):
+                blob.extracted_text = extract_text_from_image_file(blob.filepath)
+            blob.status = 'ready'
+        except Exception as e:
+            print(f"Extraction failed for blob {blob.sha256}: {e}")
+            blob.extracted_text, blob.status = f'[Error extracting text: {str(e)}]', 'failed'
+        db.session.commit()
+        if blob.status == 'ready':
+            index_blob(blob)
+        return
     try:
-        reader = PyPDF2.PdfReader(file_stream)
-        text = '\n'.join([page.extract_text() or '' for page in reader.pages])
-        return text.strip() or '[No extractable text found in PDF]'
+        with timed_stage('pdf_extraction'):
+            blob.page_count = count_pdf_pages(blob.filepath)
+            for start, stop in pdf_page_ranges(blob.page_count):
+                store_pdf_pages(blob.sha256, start, extract_pdf_page_range(blob.filepath, start, stop))
+        complete_pdf_extraction(blob)
     except Exception as e:
-        return f'[Error extracting PDF text: {str(e)}]'
+        db.session.rollback()
+        complete_pdf_extraction(blob, e)
 
-def extract_text_from_image(file_stream):
+def blob_path(sha256, file_ext):
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'blobs', sha256[:2], f'{sha256}.{file_ext}')
+
+class UploadSpool:
+    """Temp file in UPLOAD_FOLDER/tmp that Werkzeug writes an uploaded file into.
+
+    The part is hashed and counted as it arrives, so storing it is a rename: no
+    in-memory copy, and no second pass over the bytes.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory)
+        self.file = os.fdopen(fd, 'w+b')
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if filename is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        spool = UploadSpool(os.path.join(app.config['UPLOAD_FOLDER'], 'tmp'))
+        self.upload_spools = getattr(self, 'upload_spools', []) + [spool]
+        return spool
+
+app.request_class = UploadRequest
+
+@app.teardown_request
+def discard_upload_spools(exc):
+    # Parts that were never stored (bad extension, errors, rejected uploads)
+    for spool in getattr(request, 'upload_spools', ()):
+        spool.discard()
+
+def save_uploaded_file(file, file_ext, chunk_size=1024 * 1024):
+    """Store an upload content-addressed, hashing it on the way to disk.
+
+    Returns (sha256, filepath, filesize). Identical bytes map to the same blob file, so
+    a re-upload never writes a second copy and different files never overwrite each other.
+    Parts spooled by UploadRequest are renamed into place; other streams are copied in chunks.
+    """
+    if isinstance(file.stream, UploadSpool):
+        spool = file.stream
+        spool.file.close()
+        return store_upload(spool.path, spool.digest.hexdigest(), spool.size, file_ext)
+
+    tmp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    filesize = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file.stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                filesize += len(chunk)
+                out.write(chunk)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return store_upload(tmp_path, digest.hexdigest(), filesize, file_ext)
+
+def store_upload(tmp_path, sha256, filesize, file_ext):
+    """Atomically move a fully written temp file to its blob path (or drop it if already stored).
+
+    Bytes that already have a FileBlob keep its path, whatever extension they come with this time.
+    """
+    try:
+        blob = db.session.get(FileBlob, sha256)
+        filepath = blob.filepath if blob is not None else blob_path(sha256, file_ext)
+        if os.path.exists(filepath):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            os.replace(tmp_path, filepath)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return sha256, filepath, filesize
+
+def get_or_create_blob(sha256, filepath, file_ext, filesize):
+    """Return (blob, needs_extraction) for freshly stored upload bytes.
+
+    Nothing is committed: the caller commits the blob together with the UploadedFile that
+    references it, so prune_orphan_blobs never sees a new blob without its upload.
+    """
+    blob = db.session.get(FileBlob, sha256)
+    if blob is None:
+        blob = FileBlob(sha256=sha256, filepath=filepath, filetype=file_ext, filesize=filesize, status='pending')
+        db.session.add(blob)
+        try:
+            db.session.flush()
+            return blob, True
+        except IntegrityError:
+            # Another request stored the same bytes at the same moment, maybe under another extension
+            db.session.rollback()
+            blob = db.session.get(FileBlob, sha256)
+            if blob.filepath != filepath and os.path.exists(filepath):
+                os.remove(filepath)
+            return blob, False
+    stale = datetime.utcnow() - timedelta(seconds=app.config['EXTRACTION_STALE_SECONDS'])
+    if blob.status == 'failed' or (blob.status == 'pending' and (blob.queued_at or blob.created_at) < stale):
+        # Give failed extractions, and ones whose worker died, another chance when the file is uploaded again
+        BlobPage.query.filter_by(blob_sha256=sha256).delete()
+        blob.status, blob.pages_done, blob.extracted_text = 'pending', 0, None
+        blob.queued_at = datetime.utcnow()
+        return blob, True
+    return blob, False
+
+def prune_orphan_blobs():
+    """Delete blobs (files and rows) that no UploadedFile references any more"""
+    orphans = FileBlob.query.filter(
+        ~db.exists().where(UploadedFile.blob_sha256 == FileBlob.sha256)
+    ).all()
+    hashes = [blob.sha256 for blob in orphans]
+    for blob in orphans:
+        db.session.delete(blob)
+    db.session.commit()
+    # Files go only once their rows are gone, including copies stored under another extension
+    # by versions that keyed the path on it
+    for sha256 in hashes:
+        for filepath in glob.glob(blob_path(glob.escape(sha256), '*')):
+            os.remove(filepath)
+
+def file_sha256(filepath, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def adopt_legacy_upload(uploaded_file):
+    """Give an upload stored before content addressing a FileBlob that holds its text compressed.
+
+    While the file is still on disk the blob is keyed on its bytes and the file moves into the
+    blob store; otherwise the text is all that is left of it and the blob is keyed on that.
+    Rows that pointed at the same file share one blob. The caller commits.
+    """
+    legacy_text = uploaded_file.legacy_text or ''
+    sibling = UploadedFile.query.filter(
+        UploadedFile.filepath == uploaded_file.filepath, UploadedFile.blob_sha256.isnot(None)
+    ).first()
+    on_disk = sibling is None and os.path.isfile(uploaded_file.filepath)
+    if sibling is not None:
+        sha256 = sibling.blob_sha256
+    elif on_disk:
+        sha256 = file_sha256(uploaded_file.filepath)
+    else:
+        sha256 = hashlib.sha256(legacy_text.encode('utf-8')).hexdigest()
+
+    blob = db.session.get(FileBlob, sha256)
+    if blob is None:
+        filepath = uploaded_file.filepath
+        if on_disk:
+            filepath = blob_path(sha256, uploaded_file.filetype)
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            os.replace(uploaded_file.filepath, filepath)
+        blob = FileBlob(sha256=sha256, filepath=filepath, filetype=uploaded_file.filetype,
+                        filesize=uploaded_file.filesize, status='ready')
+        blob.extracted_text = legacy_text
+        db.session.add(blob)
+    elif on_disk and blob.filepath != uploaded_file.filepath:
+        # The same bytes were uploaded again later and are already in the blob store
+        os.remove(uploaded_file.filepath)
+    uploaded_file.blob = blob
+    uploaded_file.legacy_text = None
+    return blob
+
+def compact_blob_text(batch_size=50):
+    """Move legacy uncompressed text into BlobText and drop page rows already indexed.
+
+    Covers blobs written before BlobText existed and uploads from before content addressing,
+    which get a blob of their own. Returns (blobs_compacted, uploads_adopted, page_rows_deleted).
+    """
+    compacted = 0
+    while True:
+        blobs = FileBlob.query.filter(FileBlob.legacy_text.isnot(None)).limit(batch_size).all()
+        if not blobs:
+            break
+        for blob in blobs:
+            blob.extracted_text = blob.legacy_text
+        db.session.commit()
+        compacted += len(blobs)
+    adopted = 0
+    while True:
+        uploads = UploadedFile.query.filter(UploadedFile.blob_sha256.is_(None)).order_by(UploadedFile.id).limit(batch_size).all()
+        if not uploads:
+            break
+        for uploaded_file in uploads:
+            adopt_legacy_upload(uploaded_file)
+            # Later rows of the batch look for siblings in the database
+            db.session.flush()
+        db.session.commit()
+        adopted += len(uploads)
+    indexed = db.select(FileBlob.sha256).where(FileBlob.chunk_count.isnot(None))
+    pages_deleted = BlobPage.query.filter(BlobPage.blob_sha256.in_(indexed)).delete(synchronize_session=False)
+    db.session.commit()
+    return compacted, adopted, pages_deleted
+
+@app.cli.command('compact-file-text')
+@click.option('--vacuum', is_flag=True, help='Run VACUUM afterwards to give the space back (SQLite)')
+def compact_file_text_command(vacuum):
+    """Compress extracted text stored by older versions into the blob_text table"""
+    compacted, adopted, pages_deleted = compact_blob_text()
+    click.echo(f"Compressed text of {compacted} blob(s) and {adopted} older upload(s), "
+               f"removed {pages_deleted} indexed page row(s)")
+    if vacuum and db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as conn:
+            conn.execute(text('VACUUM'))
+        click.echo('Database vacuumed')
+
+# ========== BACKGROUND EXTRACTION ==========
+extraction_pool = None
+extraction_pool_lock = threading.Lock()
+extraction_slots = threading.BoundedSemaphore(app.config['EXTRACTION_QUEUE_SIZE'])
+
+def get_extraction_pool():
+    """Create the pool on first use so every gunicorn worker owns its own children"""
+    global extraction_pool
+    with extraction_pool_lock:
+        if extraction_pool is None:
+            extraction_pool = ProcessPoolExecutor(max_workers=app.config['EXTRACTION_WORKERS'])
+        return extraction_pool
+
+def submit_to_pool(fn, *args):
+    """Submit to the extraction pool, replacing it once if a dead child has broken it"""
+    global extraction_pool
+    pool = get_extraction_pool()
     try:
-        image = Image.open(file_stream)
-        text = pytesseract.image_to_string(image)
-        return text.strip() or '[No text found in image]'
+        return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        with extraction_pool_lock:
+            if extraction_pool is pool:
+                extraction_pool = None
+        pool.shutdown(wait=False)
+        print("Extraction pool is broken (a worker process died), starting a new one")
+        return get_extraction_pool().submit(fn, *args)
+
+def finish_image_extraction(sha256, submitted, future):
+    extraction_slots.release()
+    record_stage('ocr', time.perf_counter() - submitted)
+    try:
+        text, status = future.result(), 'ready'
     except Exception as e:
-        return f'[Error extracting image text: {str(e)}]'
+        print(f"Extraction failed for blob {sha256}: {e}")
+        text, status = f'[Error extracting text: {str(e)}]', 'failed'
+    with app.app_context():
+        try:
+            blob = db.session.get(FileBlob, sha256)
+            if blob:
+                blob.extracted_text = text
+                blob.status = status
+                db.session.commit()
+                if status == 'ready':
+                    index_blob(blob)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error saving extracted text for blob {sha256}: {e}")
 
-def save_uploaded_file(file, user_id):
-    filename = secure_filename(file.filename)
-    user_upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], str(user_id))
-    os.makedirs(user_upload_dir, exist_ok=True)
-    filepath = os.path.join(user_upload_dir, filename)
-    file.save(filepath)
-    return filename, filepath
+def finish_pdf_range(sha256, start, job, future):
+    """Store one finished page range; the last range to finish completes the blob"""
+    error = None
+    with app.app_context():
+        try:
+            store_pdf_pages(sha256, start, future.result())
+        except Exception as e:
+            db.session.rollback()
+            print(f"PDF extraction failed for blob {sha256} at page {start + 1}: {e}")
+            error = e
+
+        with job['lock']:
+            job['remaining'] -= 1
+            job['error'] = job['error'] or error
+            last = job['remaining'] == 0
+        if not last:
+            return
+
+        extraction_slots.release()
+        record_stage('pdf_extraction', time.perf_counter() - job['started'])
+        try:
+            blob = db.session.get(FileBlob, sha256)
+            if blob:
+                complete_pdf_extraction(blob, job['error'])
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error saving extracted text for blob {sha256}: {e}")
+
+def submit_extraction(blob):
+    """Queue extraction for a newly stored blob.
+
+    PDFs are fanned out across the pool in page ranges that are stored as they finish.
+    The caller must already hold one of extraction_slots; it is released when the job finishes.
+    If the job cannot be queued at all the blob is marked failed.
+    """
+    try:
+        if blob.filetype != 'pdf':
+            future = submit_to_pool(extract_text_from_image_file, blob.filepath)
+            future.add_done_callback(partial(finish_image_extraction, blob.sha256, time.perf_counter()))
+            return
+
+        try:
+            blob.page_count = count_pdf_pages(blob.filepath)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            complete_pdf_extraction(blob, e)
+            extraction_slots.release()
+            return
+
+        ranges = pdf_page_ranges(blob.page_count)
+        if not ranges:
+            complete_pdf_extraction(blob)
+            extraction_slots.release()
+            return
+        job = {'remaining': len(ranges), 'error': None, 'lock': threading.Lock(), 'started': time.perf_counter()}
+        futures = [(start, submit_to_pool(extract_pdf_page_range, blob.filepath, start, stop)) for start, stop in ranges]
+    except Exception as e:
+        extraction_slots.release()
+        print(f"Could not queue extraction for blob {blob.sha256}: {e}")
+        db.session.rollback()
+        blob.extracted_text = f'[Error extracting text: {str(e)}]'
+        blob.status = 'failed'
+        db.session.commit()
+        return
+    for start, future in futures:
+        future.add_done_callback(partial(finish_pdf_range, blob.sha256, start, job))
+
+# ========== AVATARS ==========
+DEFAULT_AVATAR = '/static/Avatar.jpeg'
+
+def avatar_file_path(url):
+    return os.path.join(app.static_folder, url[len('/static/'):])
+
+def make_avatar_thumbnails(filepath, sizes):
+    """Write <stem>_<size>.webp/.jpg square thumbnails next to an avatar. Runs in the extraction pool"""
+    from PIL import Image, ImageOps
+    stem = filepath.rsplit('.', 1)[0]
+    with Image.open(filepath) as image:
+        # Let the JPEG decoder downscale large photos while decoding
+        image.draft('RGB', (max(sizes) * 2, max(sizes) * 2))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = Image.alpha_composite(Image.new('RGBA', image.size, 'white'), image.convert('RGBA'))
+        image = image.convert('RGB')
+        for size in sizes:
+            thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+            thumbnail.save(f'{stem}_{size}.webp', 'WEBP', quality=80, method=4)
+            thumbnail.save(f'{stem}_{size}.jpg', 'JPEG', quality=85, optimize=True, progressive=True)
+    return sizes
+
+def remove_avatar_files(url):
+    """Delete an uploaded avatar and its thumbnails"""
+    if not url or url == DEFAULT_AVATAR or not url.startswith('/static/avatars/'):
+        return
+    filepath = avatar_file_path(url)
+    stem = os.path.basename(filepath).rsplit('.', 1)[0]
+    directory = os.path.dirname(filepath)
+    for name in os.listdir(directory) if os.path.isdir(directory) else ():
+        if name == os.path.basename(filepath) or name.startswith(f'{stem}_'):
+            os.remove(os.path.join(directory, name))
+
+def finish_avatar_thumbnails(user_id, url, future):
+    try:
+        sizes = future.result()
+    except Exception as e:
+        print(f"Avatar thumbnails failed for user {user_id}: {e}")
+        return
+    with app.app_context():
+        try:
+            updated = db.session.execute(
+                db.update(User).where(User.id == user_id, User.avatar == url)
+                .values(avatar_sizes=','.join(str(size) for size in sizes))
+            ).rowcount
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error saving avatar thumbnails for user {user_id}: {e}")
+            return
+    if updated:
+        invalidate_user_stats(user_id)
+    else:
+        # Replaced again while these were being made
+        remove_avatar_files(url)
+
+def submit_avatar_thumbnails(user_id, url):
+    """Make thumbnails for a new avatar in the extraction pool (inline when ASYNC_EXTRACTION is off)"""
+    args = (avatar_file_path(url), app.config['AVATAR_SIZES'])
+    future = Future()
+    try:
+        if app.config['ASYNC_EXTRACTION']:
+            future = submit_to_pool(make_avatar_thumbnails, *args)
+        else:
+            future.set_result(make_avatar_thumbnails(*args))
+    except Exception as e:
+        future.set_exception(e)
+    future.add_done_callback(partial(finish_avatar_thumbnails, user_id, url))
+
+def avatar_payload(user):
+    """(src, srcset) for the profile API: srcset holds WebP and JPEG candidates once thumbnails exist"""
+    if not user.avatar_sizes or not user.avatar or user.avatar == DEFAULT_AVATAR:
+        return user.avatar, None
+    stem = user.avatar.rsplit('.', 1)[0]
+    sizes = [int(size) for size in user.avatar_sizes.split(',')]
+    srcset = {
+        fmt: ', '.join(f'{stem}_{size}.{ext} {size}w' for size in sizes)
+        for fmt, ext in (('webp', 'webp'), ('jpeg', 'jpg'))
+    }
+    return f'{stem}_{sizes[len(sizes) // 2]}.jpg', srcset
+
+@app.cli.command('avatar-thumbnails')
+def avatar_thumbnails_command():
+    """Make thumbnails for avatars uploaded before they were generated on upload"""
+    users = User.query.filter(User.avatar_sizes.is_(None), User.avatar.like('/static/avatars/%')).all()
+    for user in users:
+        try:
+            sizes = make_avatar_thumbnails(avatar_file_path(user.avatar), app.config['AVATAR_SIZES'])
+        except Exception as e:
+            click.echo(f'Skipped {user.avatar}: {e}')
+            continue
+        user.avatar_sizes = ','.join(str(size) for size in sizes)
+        db.session.commit()
+    click.echo(f'Checked {len(users)} avatars')
+
+# ========== FILE RETRIEVAL ==========
+STOPWORDS = frozenset(
+    'a an and are as at be but by can do does for from had has have how i if in into is it its me my '
+    'no not of on or our so than that the their them then there these they this to was we were what '
+    'when where which who why will with you your'.split()
+)
+
+def tokenize(text):
+    return [token for token in re.findall(r'[a-z0-9]+', text.lower()) if len(token) > 1 and token not in STOPWORDS]
+
+def chunk_text(text, size, overlap):
+    """Split text into overlapping chunks of at most size chars, breaking on whitespace"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            space = max(text.rfind(' ', start + size // 2, end), text.rfind('\n', start + size // 2, end))
+            if space > start:
+                end = space
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+        # Start the overlap on a word boundary
+        space = text.find(' ', start, end)
+        if space != -1:
+            start = space + 1
+    return chunks
+
+def index_blob(blob):
+    """Chunk a blob's text (per page for PDFs) and build its BM25 inverted index"""
+    size, overlap = app.config['RETRIEVAL_CHUNK_CHARS'], app.config['RETRIEVAL_CHUNK_OVERLAP']
+    pages = []
+    if blob.filetype == 'pdf' and blob.page_count:
+        pages = db.session.execute(
+            db.select(BlobPage.page_number, BlobPage.text).filter_by(blob_sha256=blob.sha256).order_by(BlobPage.page_number)
+        ).all()
+    if not pages:
+        # Page rows are dropped once indexed, so a later re-index chunks the whole text
+        pages = [(None, blob.extracted_text or '')]
+
+    chunks = []
+    postings = {}
+    total_length = 0
+    for page_number, page_text in pages:
+        for chunk in chunk_text(page_text, size, overlap):
+            chunk_index = len(chunks)
+            chunks.append({'blob_sha256': blob.sha256, 'chunk_index': chunk_index, 'page_number': page_number, 'text': chunk})
+            tokens = tokenize(chunk)
+            total_length += len(tokens)
+            for term, frequency in Counter(tokens).items():
+                postings.setdefault(term[:64], []).append([chunk_index, frequency, len(tokens)])
+
+    try:
+        BlobChunk.query.filter_by(blob_sha256=blob.sha256).delete()
+        BlobTerm.query.filter_by(blob_sha256=blob.sha256).delete()
+        if chunks:
+            db.session.execute(db.insert(BlobChunk), chunks)
+        if postings:
+            db.session.execute(db.insert(BlobTerm), [
+                {'blob_sha256': blob.sha256, 'term': term, 'postings': json.dumps(entries)}
+                for term, entries in postings.items()
+            ])
+        blob.chunk_count = len(chunks)
+        blob.avg_chunk_length = total_length / len(chunks) if chunks else 0
+        # The chunks carry the page numbers now; the per-page copy of the text is no longer needed
+        BlobPage.query.filter_by(blob_sha256=blob.sha256).delete()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error indexing blob {blob.sha256}: {e}")
+
+def search_blob(blob, query, top_k, k1=1.5, b=0.75):
+    """Rank a blob's chunks against the query with BM25. Returns [(chunk_index, score)], best first"""
+    terms = set(tokenize(query))
+    if not terms or not blob.chunk_count:
+        return []
+    rows = BlobTerm.query.filter(BlobTerm.blob_sha256 == blob.sha256, BlobTerm.term.in_(terms)).all()
+    scores = Counter()
+    avg_length = blob.avg_chunk_length or 1
+    for row in rows:
+        entries = json.loads(row.postings)
+        idf = math.log(1 + (blob.chunk_count - len(entries) + 0.5) / (len(entries) + 0.5))
+        for chunk_index, frequency, length in entries:
+            scores[chunk_index] += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / avg_length))
+    return scores.most_common(top_k)
+
+def build_file_context(file_obj, question):
+    """Text from an uploaded file to put in the prompt, bounded by RETRIEVAL_CONTEXT_CHARS.
+
+    Small files are sent whole. Larger ones contribute only their best matching chunks,
+    in document order and labelled with page numbers; the start of the file is used when
+    nothing matches (e.g. "summarize this").
+    """
+    budget = app.config['RETRIEVAL_CONTEXT_CHARS']
+    blob = file_obj.blob
+    if file_obj.text_length <= budget:
+        return file_obj.extracted_text
+    if blob is None:
+        # An upload from before content addressing that `flask compact-file-text` has not moved yet
+        blob = adopt_legacy_upload(file_obj)
+        db.session.commit()
+    if blob.status != 'ready':
+        return file_obj.extracted_text[:budget]
+    if blob.chunk_count is None:
+        index_blob(blob)
+
+    ranked = [chunk_index for chunk_index, _ in search_blob(blob, question, app.config['RETRIEVAL_TOP_K'])]
+    if not ranked:
+        ranked = list(range(min(app.config['RETRIEVAL_TOP_K'], blob.chunk_count or 0)))
+    chunks = {
+        chunk.chunk_index: chunk
+        for chunk in BlobChunk.query.filter(BlobChunk.blob_sha256 == blob.sha256, BlobChunk.chunk_index.in_(ranked))
+    }
+
+    selected, used = [], 0
+    for chunk_index in ranked:
+        chunk = chunks.get(chunk_index)
+        if chunk is None or used + len(chunk.text) > budget:
+            continue
+        selected.append(chunk)
+        used += len(chunk.text)
+    selected.sort(key=lambda chunk: chunk.chunk_index)
+    return '\n\n'.join(
+        f"[Page {chunk.page_number}] {chunk.text}" if chunk.page_number else chunk.text
+        for chunk in selected
+    )
+
+# ========== AI RESPONSE CACHE ==========
+class MemoryResponseCache:
+    """Per-process LRU cache with a TTL on every entry"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteResponseCache:
+    """On-disk cache shared by every worker on the host, evicting least recently used entries"""
+
+    def __init__(self, path, max_entries, ttl):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS ai_cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_ai_cache_last_access ON ai_cache (last_access)')
+
+    def _connect(self):
+        # A short-lived connection per call keeps the cache safe across threads and forked workers
+        conn = sqlite3.connect(self.path, timeout=5)
+        apply_sqlite_pragmas(conn)
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('SELECT value, expires_at FROM ai_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                conn.execute('DELETE FROM ai_cache WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE ai_cache SET last_access = ? WHERE key = ?', (now, key))
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO ai_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)',
+                (key, value, now + self.ttl, now)
+            )
+            conn.execute('DELETE FROM ai_cache WHERE expires_at <= ?', (now,))
+            conn.execute(
+                'DELETE FROM ai_cache WHERE key IN ('
+                'SELECT key FROM ai_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM ai_cache').fetchone()[0]
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution whose result is shared"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, unshared=()):
+        """Run fn() once per key at a time. Returns (result, shared)
+
+        A leader's error that is an instance of `unshared` is its own (e.g. its user's quota):
+        followers then run fn() again rather than receive it.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+            if leader:
+                break
+            call['done'].wait()
+            if isinstance(call['error'], unshared):
+                continue
+            if call['error'] is not None:
+                raise call['error']
+            return call['result'], True
+        try:
+            call['result'] = fn()
+            return call['result'], False
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['done'].set()
+
+
+def create_ai_cache():
+    backend = app.config['AI_CACHE_BACKEND']
+    if backend == 'sqlite':
+        return SQLiteResponseCache(app.config['AI_CACHE_PATH'], app.config['AI_CACHE_MAX_ENTRIES'], app.config['AI_CACHE_TTL'])
+    if backend == 'memory':
+        return MemoryResponseCache(app.config['AI_CACHE_MAX_ENTRIES'], app.config['AI_CACHE_TTL'])
+    return None
+
+ai_cache = create_ai_cache()
+ai_singleflight = SingleFlight()
+ai_cache_stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+ai_cache_stats_lock = threading.Lock()
+
+def count_ai_cache(stat):
+    with ai_cache_stats_lock:
+        ai_cache_stats[stat] += 1
+
+def ai_cache_key(contents):
+    """Hash of the model name and the whitespace-normalized conversation turns"""
+    normalized = '\0'.join(f"{turn['role']}:{' '.join(turn['parts'][0]['text'].split())}" for turn in contents)
+    return hashlib.sha256(f"{app.config['GEMINI_MODEL']}\0{normalized}".encode('utf-8')).hexdigest()
+
+def cached_ai_response(key):
+    if ai_cache is None:
+        return None
+    try:
+        value = ai_cache.get(key)
+    except Exception as e:
+        print(f"AI cache read error: {e}")
+        value = None
+    count_ai_cache('hits' if value is not None else 'misses')
+    return value
+
+def store_ai_response(key, value):
+    if ai_cache is None or not value:
+        return
+    try:
+        ai_cache.set(key, value)
+    except Exception as e:
+        print(f"AI cache write error: {e}")
+
+# ========== USER COUNTERS ==========
+def count_chat_added(chat):
+    """Bump the owner's chat counters in the same transaction as the new Chat"""
+    db.session.flush()
+    timestamp = chat.timestamp
+    db.session.execute(db.update(User).where(User.id == chat.user_id).values(
+        total_chats=User.total_chats + 1,
+        latest_chat_at=case(
+            (User.latest_chat_at.is_(None) | (User.latest_chat_at < timestamp), timestamp),
+            else_=User.latest_chat_at
+        )
+    ).execution_options(synchronize_session=False))
+
+def count_chat_removed(chat):
+    """Call after session.delete(chat), in the same transaction"""
+    db.session.flush()
+    db.session.execute(db.update(User).where(User.id == chat.user_id).values(
+        total_chats=User.total_chats - 1,
+        latest_chat_at=db.select(func.max(Chat.timestamp)).where(Chat.user_id == chat.user_id).scalar_subquery()
+    ).execution_options(synchronize_session=False))
+
+def count_files_added(user_id, delta=1):
+    db.session.execute(db.update(User).where(User.id == user_id).values(
+        total_files=User.total_files + delta
+    ).execution_options(synchronize_session=False))
+
+def recompute_user_counters(user_id=None):
+    """Rebuild the denormalized counters from the chat and uploaded_file tables"""
+    statement = db.update(User).values(
+        total_chats=db.select(func.count(Chat.id)).where(Chat.user_id == User.id).scalar_subquery(),
+        total_files=db.select(func.count(UploadedFile.id)).where(UploadedFile.user_id == User.id).scalar_subquery(),
+        latest_chat_at=db.select(func.max(Chat.timestamp)).where(Chat.user_id == User.id).scalar_subquery()
+    )
+    if user_id is not None:
+        statement = statement.where(User.id == user_id)
+    return db.session.execute(statement.execution_options(synchronize_session=False)).rowcount
+
+def user_counters(user):
+    """(total_chats, total_files, latest_chat_at), filling in counters an older row never had"""
+    if user.total_chats is None or user.total_files is None:
+        recompute_user_counters(user.id)
+        db.session.commit()
+        db.session.refresh(user)
+    return user.total_chats, user.total_files, user.latest_chat_at
+
+# Short-lived per-worker copies of the profile/stats payloads. Writes made through this
+# worker drop them at once; other workers catch up within USER_STATS_CACHE_TTL seconds.
+user_stats_cache = MemoryResponseCache(10000, app.config['USER_STATS_CACHE_TTL'])
+
+def invalidate_user_stats(user_id):
+    for endpoint in ('profile', 'stats'):
+        user_stats_cache.delete((endpoint, user_id))
+
+# Per-worker copies of user rows for load_user, checked against the version in the session.
+# A worker whose copy is older than the session's version reloads the row, so a change shows
+# up on every worker from the next request of the session that made it. Other sessions of the
+# same user can see the old copy for up to USER_CACHE_TTL seconds.
+user_cache = MemoryResponseCache(10000, app.config['USER_CACHE_TTL'])
+
+# Left out of the cached copies and loaded from the row when read: the password hash, and the
+# columns other requests change with UPDATE statements without bumping the version
+USER_CACHE_SKIPPED = {'password_hash', 'total_chats', 'total_files', 'latest_chat_at', 'avatar_sizes'}
+
+def user_snapshot(user):
+    """Detached copy of a loaded User, safe to share between requests and merge into each session"""
+    snapshot = User(**{
+        column.key: getattr(user, column.key)
+        for column in User.__table__.columns if column.key not in USER_CACHE_SKIPPED
+    })
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+def bump_user_version(user):
+    """Call before committing a change to the user's row"""
+    user.version = func.coalesce(User.version, 0) + 1
+
+def user_row_changed(user):
+    """Call after the commit: drop this worker's copy and move the session onto the new version"""
+    user_cache.delete(user.id)
+    invalidate_user_stats(user.id)
+    session['_user_id'] = user.get_id()
+
+def cached_user_payload(endpoint, build):
+    """Serve a per-user JSON payload with an ETag, answering 304 when the client's copy matches"""
+    key = (endpoint, current_user.id)
+    entry = user_stats_cache.get(key)
+    if entry is None:
+        payload = build()
+        etag = hashlib.sha1(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+        entry = (payload, etag)
+        user_stats_cache.set(key, entry)
+    payload, etag = entry
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+@app.cli.command('repair-counters')
+@click.option('--user-id', type=int, default=None, help='Only repair this user')
+def repair_counters_command(user_id):
+    """Recompute total_chats, total_files and latest_chat_at from the source tables"""
+    updated = recompute_user_counters(user_id)
+    db.session.commit()
+    click.echo(f"Recomputed counters for {updated} user(s)")
+
+# ========== CONVERSATIONS ==========
+SUMMARY_INSTRUCTIONS = (
+    "Update the running summary of a conversation between a user and an AI assistant. "
+    "Keep the facts, names, preferences, decisions and open questions needed to continue it. "
+    "Reply with the updated summary only, in at most 200 words."
+)
+# Longest slice of a single message sent to the summarizer
+SUMMARY_MESSAGE_CHARS = 2000
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token) used for prompt budgets"""
+    return len(text) // 4 + 1
+
+def gemini_turn(role, text):
+    return {'role': role, 'parts': [{'text': text}]}
+
+def get_conversation(conversation_id, user_id):
+    """The user's conversation for this id, or a new one when no id is given.
+
+    New conversations are added to the session but only committed with their first chat.
+    Raises ValueError for malformed ids and LookupError for another user's conversation.
+    """
+    if not conversation_id:
+        conversation = Conversation(id=str(uuid.uuid4()), user_id=user_id, summarized_through=0)
+        db.session.add(conversation)
+        return conversation
+    conversation_id = str(uuid.UUID(str(conversation_id)))
+    conversation = db.session.get(Conversation, conversation_id)
+    if conversation is None:
+        # Threads recorded on chats before conversations had their own table
+        owner = db.session.execute(
+            db.select(Chat.user_id).where(Chat.conversation_id == conversation_id).limit(1)
+        ).scalar()
+        if owner is not None and owner != user_id:
+            raise LookupError(conversation_id)
+        conversation = Conversation(id=conversation_id, user_id=user_id, summarized_through=0)
+        db.session.add(conversation)
+    elif conversation.user_id != user_id:
+        raise LookupError(conversation_id)
+    return conversation
+
+def unsummarized_turns(conversation, limit):
+    """Newest chats not yet folded into the summary, oldest first"""
+    chats = Chat.query.filter(
+        Chat.conversation_id == conversation.id,
+        Chat.id > (conversation.summarized_through or 0)
+    ).order_by(Chat.id.desc()).limit(limit).all()
+    return chats[::-1]
+
+def build_conversation_contents(conversation, prompt):
+    """Gemini `contents` for the next message: summary, recent turns, then the prompt.
+
+    History is capped at CONVERSATION_TOKEN_BUDGET estimated tokens, newest turns first,
+    so the request stays the same size however long the conversation runs.
+    """
+    budget = app.config['CONVERSATION_TOKEN_BUDGET']
+    history = []
+    if conversation.summary:
+        history = [
+            gemini_turn('user', f"Summary of our conversation so far:\n{conversation.summary}"),
+            gemini_turn('model', 'Understood.')
+        ]
+        budget -= estimate_tokens(conversation.summary)
+
+    window = app.config['CONVERSATION_RECENT_TURNS'] + app.config['CONVERSATION_SUMMARY_EVERY']
+    turns = []
+    for chat in reversed(unsummarized_turns(conversation, window)):
+        cost = estimate_tokens(chat.user_message) + estimate_tokens(chat.ai_message)
+        if cost > budget:
+            break
+        budget -= cost
+        turns[:0] = [gemini_turn('user', chat.user_message), gemini_turn('model', chat.ai_message)]
+    return history + turns + [gemini_turn('user', prompt)]
+
+def fold_conversation(conversation_id, api_key):
+    """Fold turns that fell out of the recent window into the rolling summary.
+
+    Only the previous summary and the turns being folded are sent to Gemini, so each
+    update costs the same no matter how long the conversation is.
+    """
+    conversation = db.session.get(Conversation, conversation_id)
+    if conversation is None:
+        return
+    recent, every = app.config['CONVERSATION_RECENT_TURNS'], app.config['CONVERSATION_SUMMARY_EVERY']
+    through = conversation.summarized_through or 0
+    pending = Chat.query.filter(Chat.conversation_id == conversation_id, Chat.id > through).count()
+    if pending < recent + every:
+        return
+    folded = Chat.query.filter(Chat.conversation_id == conversation_id, Chat.id > through)\
+                       .order_by(Chat.id).limit(min(pending - recent, 2 * every)).all()
+
+    exchanges = '\n'.join(
+        f"User: {chat.user_message[:SUMMARY_MESSAGE_CHARS]}\nAssistant: {chat.ai_message[:SUMMARY_MESSAGE_CHARS]}"
+        for chat in folded
+    )
+    prompt = (f"{SUMMARY_INSTRUCTIONS}\n\nCurrent summary:\n{conversation.summary or '(none yet)'}"
+              f"\n\nNew exchanges:\n{exchanges}")
+    summary = generate_ai_response([gemini_turn('user', prompt)], api_key)
+    if not summary:
+        return
+    # Another request may have folded the same turns meanwhile; only the first update wins
+    db.session.execute(
+        db.update(Conversation)
+        .where(Conversation.id == conversation_id, Conversation.summarized_through == conversation.summarized_through)
+        .values(summary=summary[:app.config['CONVERSATION_SUMMARY_CHARS']], summarized_through=folded[-1].id)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+def fold_conversation_after(response, conversation_id, api_key):
+    """Update the rolling summary in a background thread once the response has been sent"""
+    def run():
+        with app.app_context():
+            try:
+                fold_conversation(conversation_id, api_key)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error summarizing conversation {conversation_id}: {e}")
+    response.call_on_close(lambda: threading.Thread(target=run, daemon=True).start())
+    return response
 
 # ========== API ROUTES ==========
 
@@ -175,18 +1733,22 @@ def logout():
 @app.route('/api/profile', methods=['GET'])
 @login_required
 def get_profile():
-    user = current_user
-    total_chats = Chat.query.filter_by(user_id=user.id).count()
-    return jsonify({
-        'username': user.username,
-        'email': user.email,
-        'avatar': user.avatar,
-        'theme': user.theme,
-        'notifications': user.notifications,
-        'language': user.language,
-        'joined_date': user.joined_date.strftime('%Y-%m-%d'),
-        'total_chats': total_chats
-    })
+    def build():
+        user = current_user
+        total_chats, _, _ = user_counters(user)
+        avatar_src, avatar_srcset = avatar_payload(user)
+        return {
+            'username': user.username,
+            'email': user.email,
+            'avatar': avatar_src,
+            'avatar_srcset': avatar_srcset,
+            'theme': user.theme,
+            'notifications': user.notifications,
+            'language': user.language,
+            'joined_date': user.joined_date.strftime('%Y-%m-%d'),
+            'total_chats': total_chats
+        }
+    return cached_user_payload('profile', build)
 
 @app.route('/api/profile/update', methods=['POST'])
 @login_required
@@ -227,9 +1789,11 @@ def update_profile():
     user.theme = data.get('theme', user.theme)
     user.notifications = data.get('notifications', user.notifications)
     user.language = data.get('language', user.language)
+    bump_user_version(user)
     
     try:
         db.session.commit()
+        user_row_changed(user)
         return jsonify({'message': 'Profile updated successfully'})
     except Exception as e:
         db.session.rollback()
@@ -253,14 +1817,20 @@ def upload_avatar():
         avatars_dir = os.path.join(app.static_folder, 'avatars')
         os.makedirs(avatars_dir, exist_ok=True)
         
-        # Save the file with a unique name
-        filename = f"avatar_{current_user.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file.filename.rsplit('.', 1)[1].lower()}"
+        # Save the file with a unique name; thumbnails are named after it
+        filename = f"avatar_{current_user.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.{file.filename.rsplit('.', 1)[1].lower()}"
         filepath = os.path.join(avatars_dir, filename)
         file.save(filepath)
         
         # Update user's avatar path
+        previous_avatar = current_user.avatar
         current_user.avatar = f'/static/avatars/{filename}'
+        current_user.avatar_sizes = None
+        bump_user_version(current_user)
         db.session.commit()
+        user_row_changed(current_user)
+        remove_avatar_files(previous_avatar)
+        submit_avatar_thumbnails(current_user.id, current_user.avatar)
         
         return jsonify({
             'message': 'Avatar updated successfully',
@@ -281,16 +1851,22 @@ def delete_account():
             import shutil
             shutil.rmtree(user_upload_dir)
         
-        # Delete user's avatar if it's not the default
-        if current_user.avatar and current_user.avatar != '/static/Avatar.jpeg':
-            avatar_path = os.path.join(app.static_folder, current_user.avatar.lstrip('/static/'))
-            if os.path.exists(avatar_path):
-                os.remove(avatar_path)
+        # Delete user's avatar and its thumbnails if it's not the default
+        remove_avatar_files(current_user.avatar)
         
         # The database cascades will handle deleting chats and files records
         db.session.delete(current_user)
         db.session.commit()
+        user_cache.delete(user_id)
+        invalidate_user_stats(user_id)
         logout_user()
+
+        # Shared upload blobs are only removed once no other account references them
+        try:
+            prune_orphan_blobs()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error pruning upload blobs: {e}")
         
         return jsonify({'message': 'Account deleted successfully'})
     except Exception as e:
@@ -299,19 +1875,244 @@ def delete_account():
 
 @app.route('/api/chat', methods=['POST'])
 @login_required
+@live_user_required
 def save_chat():
     data = request.get_json()
-    chat = Chat(user_id=current_user.id, user_message=data.get('user_message', '').strip(), ai_message=data.get('ai_message', '').strip())
+    conversation_id = None
+    if data.get('conversation_id'):
+        try:
+            conversation_id = get_conversation(data['conversation_id'], current_user.id).id
+        except ValueError:
+            return jsonify({'error': 'Invalid conversation id'}), 400
+        except LookupError:
+            return jsonify({'error': 'Conversation not found'}), 404
+    chat = Chat(user_id=current_user.id, user_message=data.get('user_message', '').strip(), ai_message=data.get('ai_message', '').strip(),
+                conversation_id=conversation_id)
     db.session.add(chat)
+    count_chat_added(chat)
     db.session.commit()
+    invalidate_user_stats(chat.user_id)
     return jsonify({
         'message': 'Chat saved',
         'chat_id': chat.id,
+        'conversation_id': chat.conversation_id,
         'timestamp': chat.timestamp.isoformat()
     }), 201
 
+def build_ai_prompt(user_message, file_id, user_id):
+    """Build the Gemini prompt, prepending the uploaded file's text when a file is attached"""
+    prompt = user_message
+    if file_id:
+        try:
+            file_obj = UploadedFile.query.filter_by(id=file_id, user_id=user_id).first()
+            if file_obj and file_obj.text_length:
+                context = build_file_context(file_obj, user_message)
+                prompt = f"Context from file \"{file_obj.filename}\":\n{context}\n\nQuestion: {user_message}"
+        except Exception as e:
+            print(f"Error loading file context: {e}")
+    return prompt
+
+# ========== GEMINI CLIENT ==========
+def gemini_url(method, api_key):
+    return f"{app.config['GEMINI_API_BASE']}/models/{app.config['GEMINI_MODEL']}:{method}?key={api_key}"
+
+def extract_gemini_text(result):
+    return result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
+
+class GeminiUnavailable(Exception):
+    """Gemini answered with a non-OK status, kept failing through the retries, or the circuit breaker is open"""
+
+    def __init__(self, status, retry_after=None):
+        super().__init__(status)
+        self.status = status
+        self.retry_after = retry_after  # seconds, when known
+
+class GeminiBusy(Exception):
+    """No free Gemini slot for this user ('user') or this worker ('global') within GEMINI_QUEUE_TIMEOUT"""
+
+    def __init__(self, scope):
+        super().__init__(scope)
+        self.scope = scope
+
+class CircuitBreaker:
+    """Fails calls fast for `cooldown` seconds after `threshold` failed calls in a row, then lets one trial call through"""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        """0 when a call may go ahead, otherwise the seconds until one may"""
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            remaining = self._opened_at + self.cooldown - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self._trial:
+                return 1  # another request is finding out whether the upstream is back
+            self._trial = True
+            return 0
+
+    def record(self, ok):
+        with self._lock:
+            self._trial = False
+            if ok:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self.threshold and (self._opened_at is not None or self._failures >= self.threshold):
+                self._opened_at = time.monotonic()
+
+class InFlightLimiter:
+    """Caps concurrent calls overall and per user; a call waits up to `timeout` seconds for a slot"""
+
+    def __init__(self, max_total, max_per_user, timeout):
+        self.max_total = max_total
+        self.max_per_user = max_per_user
+        self.timeout = timeout
+        self._active = 0
+        self._per_user = defaultdict(int)
+        self._cond = threading.Condition()
+
+    def acquire(self, user_id=None):
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                if user_id is not None and self._per_user[user_id] >= self.max_per_user:
+                    scope = 'user'
+                elif self._active >= self.max_total:
+                    scope = 'global'
+                else:
+                    break
+                remaining = started + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    if user_id is not None and not self._per_user[user_id]:
+                        del self._per_user[user_id]
+                    GEMINI_REJECTED.labels(f'{scope}_limit').inc()
+                    raise GeminiBusy(scope)
+                self._cond.wait(remaining)
+            self._active += 1
+            if user_id is not None:
+                self._per_user[user_id] += 1
+        record_stage('gemini_queue', time.monotonic() - started)
+
+    def release(self, user_id=None):
+        with self._cond:
+            self._active -= 1
+            if user_id is not None:
+                self._per_user[user_id] -= 1
+                if not self._per_user[user_id]:
+                    del self._per_user[user_id]
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, user_id=None):
+        self.acquire(user_id)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+# Both are per worker process: the global limit across the deployment is GEMINI_MAX_CONCURRENCY x workers
+gemini_breaker = CircuitBreaker(app.config['GEMINI_BREAKER_THRESHOLD'], app.config['GEMINI_BREAKER_COOLDOWN'])
+gemini_limiter = InFlightLimiter(app.config['GEMINI_MAX_CONCURRENCY'], app.config['GEMINI_USER_CONCURRENCY'], app.config['GEMINI_QUEUE_TIMEOUT'])
+
+GEMINI_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def retry_after_seconds(response):
+    """The Retry-After header as seconds from now, given either as a number or an HTTP date"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def gemini_request(method, api_key, contents, stream=False):
+    """POST turns to a Gemini method and return the OK response, retrying 429/5xx answers and dropped connections.
+
+    Raises GeminiUnavailable for any other non-OK answer, when the retries run out, or while
+    the circuit breaker is open. Read timeouts are not retried: Gemini may still be working on
+    the call, and a second one would double the wait.
+    """
+    wait = gemini_breaker.retry_after()
+    if wait:
+        GEMINI_REJECTED.labels('circuit_open').inc()
+        raise GeminiUnavailable('circuit open', retry_after=wait)
+    url = gemini_url(method, api_key) + ('&alt=sse' if stream else '')
+    attempt = 0
+    while True:
+        try:
+            response = gemini_session.post(
+                url,
+                headers={'Content-Type': 'application/json'},
+                json={'contents': contents},
+                timeout=app.config['GEMINI_TIMEOUT'],
+                stream=stream
+            )
+        except requests.exceptions.RequestException as e:
+            GEMINI_RESPONSES.labels('timeout' if isinstance(e, requests.exceptions.Timeout) else 'error').inc()
+            if not isinstance(e, requests.exceptions.ConnectionError) or attempt >= app.config['GEMINI_MAX_RETRIES']:
+                gemini_breaker.record(False)
+                raise
+            delay = None
+        else:
+            GEMINI_RESPONSES.labels(str(response.status_code)).inc()
+            if response.ok:
+                gemini_breaker.record(True)
+                return response
+            response.close()
+            if response.status_code not in GEMINI_RETRY_STATUSES:
+                gemini_breaker.record(True)  # the upstream is up, it turned down this request
+                raise GeminiUnavailable(response.status_code)
+            delay = retry_after_seconds(response)
+            if attempt >= app.config['GEMINI_MAX_RETRIES'] or (delay or 0) > app.config['GEMINI_RETRY_MAX_DELAY']:
+                gemini_breaker.record(False)
+                raise GeminiUnavailable(response.status_code, retry_after=delay)
+        # Full jitter, so workers throttled at the same moment don't come back in step
+        base = app.config['GEMINI_RETRY_BASE']
+        if delay is None:
+            delay = random.uniform(0, min(app.config['GEMINI_RETRY_MAX_DELAY'], base * 2 ** attempt))
+        else:
+            delay += random.uniform(0, base)
+        attempt += 1
+        GEMINI_RETRIES.inc()
+        time.sleep(delay)
+
+def generate_ai_response(contents, api_key, user_id=None):
+    """Call Gemini's generateContent with a list of turns and return the stripped answer text"""
+    with gemini_limiter.slot(user_id), timed_stage('gemini'):
+        with gemini_request('generateContent', api_key, contents) as response:
+            result = response.json()
+    return extract_gemini_text(result).strip()
+
+def gemini_error_response(e):
+    """JSON error, status and headers for a GeminiUnavailable or GeminiBusy"""
+    if isinstance(e, GeminiBusy):
+        if e.scope == 'user':
+            return {'error': 'You already have AI requests in progress. Please wait for them to finish.'}, 429, {'Retry-After': '1'}
+        return {'error': 'AI service is busy. Please try again.'}, 503, {'Retry-After': '1'}
+    headers = {'Retry-After': str(math.ceil(e.retry_after))} if e.retry_after else {}
+    return {'error': 'AI service temporarily unavailable'}, 503, headers
+
+# ========== AI CHAT ROUTES ==========
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
 @app.route('/api/ai/chat', methods=['POST'])
 @login_required
+@live_user_required
 def ai_chat():
     """Generate AI response using Gemini API"""
     try:
@@ -322,35 +2123,34 @@ def ai_chat():
         if not user_message:
             return jsonify({'error': 'Message is required'}), 400
         
+        try:
+            conversation = get_conversation(data.get('conversation_id'), current_user.id)
+        except ValueError:
+            return jsonify({'error': 'Invalid conversation id'}), 400
+        except LookupError:
+            return jsonify({'error': 'Conversation not found'}), 404
+        
         # Build prompt with file context if provided
-        prompt = user_message
-        if file_id:
-            try:
-                file_obj = UploadedFile.query.filter_by(id=file_id, user_id=current_user.id).first()
-                if file_obj and file_obj.extracted_text:
-                    prompt = f"Context from file \"{file_obj.filename}\":\n{file_obj.extracted_text}\n\nQuestion: {user_message}"
-            except Exception as e:
-                print(f"Error loading file context: {e}")
+        prompt = build_ai_prompt(user_message, file_id, current_user.id)
+        contents = build_conversation_contents(conversation, prompt)
         
         # Call Gemini API
         api_key = os.environ.get('GEMINI_API_KEY')
         if not api_key:
             return jsonify({'error': 'AI service not configured'}), 500
         
-        response = requests.post(
-            f'https://generativelanguage.googleapis.com/v1/models/gemini-1.5-flash:generateContent?key={api_key}',
-            headers={'Content-Type': 'application/json'},
-            json={
-                'contents': [{'parts': [{'text': prompt}]}]
-            },
-            timeout=30
-        )
-        
-        if not response.ok:
-            return jsonify({'error': 'AI service temporarily unavailable'}), 503
-        
-        result = response.json()
-        ai_response = result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '').strip()
+        # Serve repeated prompts from the cache; identical in-flight prompts share one upstream call
+        cache_key = ai_cache_key(contents)
+        ai_response = cached_ai_response(cache_key)
+        if ai_response is None:
+            def fetch():
+                answer = generate_ai_response(contents, api_key, current_user.id)
+                store_ai_response(cache_key, answer)
+                return answer
+            # The leader's per-user slot is taken for its own user, so a GeminiBusy is not passed on
+            ai_response, shared = ai_singleflight.do(cache_key, fetch, unshared=(GeminiBusy,))
+            if shared:
+                count_ai_cache('coalesced')
         
         if not ai_response:
             ai_response = 'Sorry, I could not generate a response.'
@@ -359,17 +2159,24 @@ def ai_chat():
         chat = Chat(
             user_id=current_user.id,
             user_message=user_message,
-            ai_message=ai_response
+            ai_message=ai_response,
+            conversation_id=conversation.id
         )
         db.session.add(chat)
+        count_chat_added(chat)
         db.session.commit()
+        invalidate_user_stats(chat.user_id)
         
-        return jsonify({
+        return fold_conversation_after(jsonify({
             'response': ai_response,
             'chat_id': chat.id,
+            'conversation_id': chat.conversation_id,
             'timestamp': chat.timestamp.isoformat()
-        })
+        }), chat.conversation_id, api_key)
         
+    except (GeminiUnavailable, GeminiBusy) as e:
+        payload, status, headers = gemini_error_response(e)
+        return jsonify(payload), status, headers
     except requests.exceptions.Timeout:
         return jsonify({'error': 'AI service timeout. Please try again.'}), 504
     except requests.exceptions.RequestException as e:
@@ -379,24 +2186,298 @@ def ai_chat():
         print(f"Unexpected error in ai_chat: {e}")
         return jsonify({'error': 'Something went wrong. Please try again.'}), 500
 
+@app.route('/api/ai/chat/stream', methods=['POST'])
+@login_required
+@live_user_required
+def ai_chat_stream():
+    """Stream the Gemini response as Server-Sent Events.
+
+    Emits `token` events with text chunks as they arrive, then a single `done`
+    event once the full answer has been saved as a Chat row, or an `error` event.
+    """
+    data = request.get_json()
+    user_message = data.get('message', '').strip()
+    file_id = data.get('file_id')
+
+    if not user_message:
+        return jsonify({'error': 'Message is required'}), 400
+
+    api_key = os.environ.get('GEMINI_API_KEY')
+    if not api_key:
+        return jsonify({'error': 'AI service not configured'}), 500
+
+    user_id = current_user.id
+    try:
+        conversation = get_conversation(data.get('conversation_id'), user_id)
+    except ValueError:
+        return jsonify({'error': 'Invalid conversation id'}), 400
+    except LookupError:
+        return jsonify({'error': 'Conversation not found'}), 404
+    conversation_id = conversation.id
+    prompt = build_ai_prompt(user_message, file_id, user_id)
+    contents = build_conversation_contents(conversation, prompt)
+
+    cache_key = ai_cache_key(contents)
+    cached = cached_ai_response(cache_key)
+    if not cached:
+        # Take the slot before answering, so a user over the limit gets a 429 rather than an error event
+        try:
+            gemini_limiter.acquire(user_id)
+        except GeminiBusy as e:
+            payload, status, headers = gemini_error_response(e)
+            return jsonify(payload), status, headers
+
+    def stream_gemini(chunks):
+        started = time.perf_counter()
+        try:
+            with gemini_request('streamGenerateContent', api_key, contents, stream=True) as response:
+                try:
+                    for line in response.iter_lines():
+                        if not line.startswith(b'data:'):
+                            continue
+                        text = extract_gemini_text(json.loads(line[5:].decode('utf-8')))
+                        if text:
+                            chunks.append(text)
+                            yield sse_event('token', {'text': text})
+                except requests.exceptions.RequestException as e:
+                    GEMINI_RESPONSES.labels('timeout' if isinstance(e, requests.exceptions.Timeout) else 'error').inc()
+                    raise
+        finally:
+            record_stage('gemini_stream', time.perf_counter() - started)
+
+    def generate():
+        chunks = []
+        try:
+            if cached:
+                chunks.append(cached)
+                yield sse_event('token', {'text': cached})
+            else:
+                yield from stream_gemini(chunks)
+                store_ai_response(cache_key, ''.join(chunks).strip())
+        except GeminiUnavailable as e:
+            yield sse_event('error', gemini_error_response(e)[0])
+            return
+        except requests.exceptions.Timeout:
+            yield sse_event('error', {'error': 'AI service timeout. Please try again.'})
+            return
+        except requests.exceptions.RequestException as e:
+            print(f"Gemini API error: {e}")
+            yield sse_event('error', {'error': 'AI service error. Please try again later.'})
+            return
+        except ValueError as e:
+            print(f"Malformed Gemini stream: {e}")
+            yield sse_event('error', {'error': 'AI service error. Please try again later.'})
+            return
+
+        ai_response = ''.join(chunks).strip() or 'Sorry, I could not generate a response.'
+        try:
+            chat = Chat(user_id=user_id, user_message=user_message, ai_message=ai_response, conversation_id=conversation_id)
+            db.session.add(chat)
+            count_chat_added(chat)
+            db.session.commit()
+            invalidate_user_stats(user_id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error saving streamed chat: {e}")
+            yield sse_event('error', {'error': 'Something went wrong. Please try again.'})
+            return
+        yield sse_event('done', {
+            'response': ai_response,
+            'chat_id': chat.id,
+            'conversation_id': conversation_id,
+            'timestamp': chat.timestamp.isoformat()
+        })
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    if not cached:
+        response.call_on_close(partial(gemini_limiter.release, user_id))
+    return fold_conversation_after(response, conversation_id, api_key)
+
+@app.route('/api/ai/cache/stats', methods=['GET'])
+@login_required
+def ai_cache_statistics():
+    """Hit/miss counters of this worker's AI response cache, for monitoring"""
+    with ai_cache_stats_lock:
+        stats = dict(ai_cache_stats)
+    lookups = stats['hits'] + stats['misses']
+    try:
+        entries = len(ai_cache) if ai_cache is not None else 0
+    except Exception:
+        entries = None
+    return jsonify({
+        'backend': app.config['AI_CACHE_BACKEND'],
+        'entries': entries,
+        'hit_ratio': round(stats['hits'] / lookups, 4) if lookups else None,
+        'pid': os.getpid(),
+        **stats
+    })
+
+def chat_cursor(chat):
+    return f"{chat.timestamp.isoformat()},{chat.id}"
+
+def parse_chat_cursor(value):
+    """Parse a `<iso timestamp>,<chat id>` keyset cursor. Raises ValueError if malformed"""
+    timestamp, chat_id = value.rsplit(',', 1)
+    return datetime.fromisoformat(timestamp), int(chat_id)
+
+# Characters of user_message returned by /api/chats?preview=1 (the sidebar)
+CHAT_PREVIEW_CHARS = 100
+
+def user_chats_before(user_id, limit, before=None, preview=False):
+    """One newest-first page of a user's chats, strictly older than the `before` cursor.
+
+    Walks ix_chat_user_id_timestamp_id, so the cost is the same at any depth. With
+    preview=True only id, timestamp and the start of user_message are read, leaving
+    the AI answers on disk. Returns (chats, next_cursor); next_cursor is None on the last page.
+    """
+    if preview:
+        query = db.select(Chat.id, Chat.timestamp, func.substr(Chat.user_message, 1, CHAT_PREVIEW_CHARS).label('user_message'))
+    else:
+        query = db.select(Chat)
+    query = query.where(Chat.user_id == user_id)
+    if before is not None:
+        query = query.where(tuple_(Chat.timestamp, Chat.id) < before)
+    result = db.session.execute(query.order_by(Chat.timestamp.desc(), Chat.id.desc()).limit(limit + 1))
+    chats = result.all() if preview else result.scalars().all()
+    return chats[:limit], (chat_cursor(chats[limit - 1]) if len(chats) > limit else None)
+
+def wants_total():
+    return request.args.get('include_total', 'false').lower() in ('1', 'true')
+
 @app.route('/api/chats', methods=['GET'])
 @login_required
 def get_chats():
-    page = request.args.get('page', 1, type=int)
     per_page = min(request.args.get('per_page', 20, type=int), 100)
-    chats = Chat.query.filter_by(user_id=current_user.id).order_by(Chat.timestamp.desc()).paginate(page=page, per_page=per_page, error_out=False)
-    return jsonify({
-        'chats': [{
+
+    if 'page' in request.args and 'before' not in request.args:
+        # Offset pagination for older clients; prefer ?before=<cursor>
+        page = request.args.get('page', 1, type=int)
+        chats = Chat.query.filter_by(user_id=current_user.id).order_by(Chat.timestamp.desc(), Chat.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        return jsonify({
+            'chats': [{
+                'id': chat.id,
+                'user_message': chat.user_message,
+                'ai_message': chat.ai_message,
+                'timestamp': chat.timestamp.isoformat()
+            } for chat in chats.items],
+            'total': chats.total,
+            'pages': chats.pages,
+            'current_page': chats.page
+        })
+
+    try:
+        before = parse_chat_cursor(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    preview = request.args.get('preview', 'false').lower() in ('1', 'true')
+    chats, next_cursor = user_chats_before(current_user.id, per_page, before, preview=preview)
+    if preview:
+        items = [{'id': chat.id, 'user_message': chat.user_message, 'timestamp': chat.timestamp.isoformat()} for chat in chats]
+    else:
+        items = [{
             'id': chat.id,
             'user_message': chat.user_message,
             'ai_message': chat.ai_message,
             'timestamp': chat.timestamp.isoformat()
-        } for chat in chats.items],
-        'total': chats.total,
-        'pages': chats.pages,
-        'current_page': chats.page
+        } for chat in chats]
+    return jsonify({
+        'chats': items,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
+        'total': Chat.query.filter_by(user_id=current_user.id).count() if wants_total() else None
     })
 
+chat_fts_enabled = None  # unknown until the first search looks for the chat_fts table
+SNIPPET_OPEN, SNIPPET_CLOSE = '\x02', '\x03'
+
+def fts_query(query):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix"""
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words[:-1]) + (' ' if len(words) > 1 else '') + f'"{words[-1]}"*'
+
+def highlight_snippet(snippet):
+    """HTML-escape an FTS snippet, then turn its match markers into <mark> tags"""
+    return html.escape(snippet).replace(SNIPPET_OPEN, '<mark>').replace(SNIPPET_CLOSE, '</mark>')
+
+def like_snippet(message, query, width=60):
+    """Snippet around the first case-insensitive match, for databases without FTS5"""
+    position = message.lower().find(query.lower())
+    if position == -1:
+        return html.escape(message[:2 * width]) + ('…' if len(message) > 2 * width else '')
+    start, end = max(position - width, 0), position + len(query) + width
+    return (('…' if start else '') + html.escape(message[start:position])
+            + '<mark>' + html.escape(message[position:position + len(query)]) + '</mark>'
+            + html.escape(message[position + len(query):end]) + ('…' if end < len(message) else ''))
+
+def chat_fts_available():
+    """Whether `flask init-db` has created the FTS5 index; checked once per worker"""
+    global chat_fts_enabled
+    if chat_fts_enabled is None:
+        chat_fts_enabled = db.engine.dialect.name == 'sqlite' and db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'chat_fts'")
+        ).first() is not None
+    return chat_fts_enabled
+
+@app.route('/api/chats/search', methods=['GET'])
+@login_required
+def search_chats():
+    """Ranked full-text search over the current user's chats, with highlighted snippets"""
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 50)
+    offset = (page - 1) * per_page
+    if not query:
+        return jsonify({'results': [], 'page': page, 'per_page': per_page, 'has_more': False})
+
+    if chat_fts_available():
+        match = fts_query(query)
+        if not match:
+            return jsonify({'results': [], 'page': page, 'per_page': per_page, 'has_more': False})
+        # Rank first and build snippets only for the requested page; snippet() is the costly part
+        rows = db.session.execute(text(
+            "WITH page AS ("
+            "  SELECT chat_fts.rowid AS id, chat_fts.rank AS rank FROM chat_fts JOIN chat ON chat.id = chat_fts.rowid"
+            "  WHERE chat_fts MATCH :match AND chat.user_id = :user_id"
+            "  ORDER BY chat_fts.rank LIMIT :limit OFFSET :offset"
+            ") "
+            "SELECT chat.id, chat.user_message, chat.timestamp, "
+            "snippet(chat_fts, 0, :open, :close, '…', 12) AS user_snippet, "
+            "snippet(chat_fts, 1, :open, :close, '…', 16) AS ai_snippet "
+            "FROM page JOIN chat_fts ON chat_fts.rowid = page.id JOIN chat ON chat.id = page.id "
+            "WHERE chat_fts MATCH :match ORDER BY page.rank"
+        ), {
+            'open': SNIPPET_OPEN, 'close': SNIPPET_CLOSE, 'match': match,
+            'user_id': current_user.id, 'limit': per_page + 1, 'offset': offset
+        }).all()
+        results = [{
+            'id': row.id,
+            'user_message': row.user_message,
+            'timestamp': datetime.fromisoformat(str(row.timestamp)).isoformat(),
+            'user_snippet': highlight_snippet(row.user_snippet),
+            'ai_snippet': highlight_snippet(row.ai_snippet)
+        } for row in rows[:per_page]]
+    else:
+        pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        rows = Chat.query.filter(
+            Chat.user_id == current_user.id,
+            Chat.user_message.ilike(pattern, escape='\\') | Chat.ai_message.ilike(pattern, escape='\\')
+        ).order_by(Chat.timestamp.desc()).offset(offset).limit(per_page + 1).all()
+        results = [{
+            'id': chat.id,
+            'user_message': chat.user_message,
+            'timestamp': chat.timestamp.isoformat(),
+            'user_snippet': like_snippet(chat.user_message, query),
+            'ai_snippet': like_snippet(chat.ai_message, query)
+        } for chat in rows[:per_page]]
+
+    return jsonify({'results': results, 'page': page, 'per_page': per_page, 'has_more': len(rows) > per_page})
+
 @app.route('/api/chats/<int:chat_id>', methods=['GET'])
 @login_required
 def get_chat(chat_id):
@@ -406,6 +2487,7 @@ def get_chat(chat_id):
     return jsonify({
         'user_message': chat.user_message,
         'ai_message': chat.ai_message,
+        'conversation_id': chat.conversation_id,
         'timestamp': chat.timestamp.isoformat()
     })
 
@@ -416,46 +2498,95 @@ def delete_chat(chat_id):
     if not chat:
         return jsonify({'error': 'Chat not found'}), 404
     db.session.delete(chat)
+    count_chat_removed(chat)
     db.session.commit()
+    invalidate_user_stats(chat.user_id)
     return jsonify({'message': 'Chat deleted'}), 200
 
 @app.route('/api/files', methods=['POST'])
 @login_required
+@live_user_required
 def upload_file():
     file = request.files.get('file')
     if not file or file.filename == '' or not allowed_file(file.filename):
         return jsonify({'error': 'Invalid or missing file'}), 400
 
-    filename, filepath = save_uploaded_file(file, current_user.id)
-    file_ext = filename.rsplit('.', 1)[1].lower()
+    file_ext = file.filename.rsplit('.', 1)[1].lower()
+    filename = secure_filename(file.filename)
+    if not filename.lower().endswith(f'.{file_ext}'):
+        # Non-ASCII names can lose everything but the extension, e.g. "файл.pdf" -> "pdf"
+        filename = f'upload.{file_ext}'
 
-    with open(filepath, 'rb') as f:
-        file_stream = io.BytesIO(f.read())
+    # Backpressure: refuse new uploads while the extraction queue is full
+    async_mode = app.config['ASYNC_EXTRACTION']
+    if async_mode and not extraction_slots.acquire(blocking=False):
+        return jsonify({'error': 'Too many files are being processed. Please try again shortly.'}), 503, {'Retry-After': '5'}
 
-    if file_ext == 'pdf':
-        text = extract_text_from_pdf(file_stream)
-    else:
-        text = extract_text_from_image(file_stream)
-
-    uploaded_file = UploadedFile(
-        user_id=current_user.id,
-        filename=filename,
-        filepath=filepath,
-        filetype=file_ext,
-        filesize=os.path.getsize(filepath),
-        extracted_text=text
-    )
-    db.session.add(uploaded_file)
-    db.session.commit()
+    try:
+        with timed_stage('upload_save'):
+            sha256, filepath, filesize = save_uploaded_file(file, file_ext)
+        UPLOAD_BYTES.inc(filesize)
+        g.request_metrics['upload_bytes'] = filesize
+        blob, needs_extraction = get_or_create_blob(sha256, filepath, file_ext, filesize)
+
+        uploaded_file = UploadedFile(
+            user_id=current_user.id,
+            filename=filename,
+            filepath=blob.filepath,
+            filetype=file_ext,
+            filesize=filesize,
+            blob_sha256=blob.sha256
+        )
+        db.session.add(uploaded_file)
+        count_files_added(current_user.id)
+        # A new blob is committed here with its first upload, never on its own
+        db.session.commit()
+        invalidate_user_stats(current_user.id)
+    except Exception:
+        if async_mode:
+            extraction_slots.release()
+        raise
+
+    if needs_extraction and async_mode:
+        submit_extraction(blob)
+    elif needs_extraction:
+        extract_blob_inline(blob)
+    elif async_mode:
+        # Same bytes were uploaded before: reuse their text instead of extracting again
+        extraction_slots.release()
+
+    if uploaded_file.status == 'pending':
+        return jsonify({
+            'message': 'File uploaded, extracting text',
+            'file_id': uploaded_file.id,
+            'filename': filename,
+            'filetype': file_ext,
+            'status': 'pending'
+        }), 202
 
     return jsonify({
         'message': 'File uploaded successfully',
         'file_id': uploaded_file.id,
         'filename': filename,
         'filetype': file_ext,
-        'text': text
+        'status': uploaded_file.status,
+        'text': uploaded_file.extracted_text
     }), 201
 
+@app.route('/api/files/<int:file_id>/status', methods=['GET'])
+@login_required
+def get_file_status(file_id):
+    file = UploadedFile.query.filter_by(id=file_id, user_id=current_user.id).first()
+    if not file:
+        return jsonify({'error': 'File not found'}), 404
+    return jsonify({
+        'file_id': file.id,
+        'filename': file.filename,
+        'status': file.status,
+        'page_count': file.page_count,
+        'pages_done': file.pages_done
+    })
+
 @app.route('/uploaded-files/<int:file_id>', methods=['GET'])
 @login_required
 def get_uploaded_file(file_id):
@@ -467,33 +2598,132 @@ def get_uploaded_file(file_id):
         'extracted_text': file.extracted_text
     })
 
+EXPORT_FORMATS = {
+    'json': ('application/json', 'json'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+}
+
+def iter_export_batches(user_id, since=None, until=None):
+    """Yield the user's chats oldest-first in EXPORT_BATCH_SIZE batches.
+
+    Each batch is a keyset query on (timestamp, id) that selects plain rows, so nothing
+    accumulates in the session however long the history is.
+    """
+    batch_size = app.config['EXPORT_BATCH_SIZE']
+    query = db.select(Chat.id, Chat.user_message, Chat.ai_message, Chat.timestamp).where(Chat.user_id == user_id)
+    if since is not None:
+        query = query.where(Chat.timestamp >= since)
+    if until is not None:
+        query = query.where(Chat.timestamp < until)
+    after = None
+    while True:
+        page = query if after is None else query.where(tuple_(Chat.timestamp, Chat.id) > after)
+        rows = db.session.execute(page.order_by(Chat.timestamp, Chat.id).limit(batch_size)).all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        after = (rows[-1].timestamp, rows[-1].id)
+
+def export_record(row):
+    return {
+        'user_message': row.user_message,
+        'ai_message': row.ai_message,
+        'timestamp': row.timestamp.isoformat()
+    }
+
+def render_export(fmt, batches):
+    """Serialize batches of chat rows into text chunks in the requested format"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['timestamp', 'user_message', 'ai_message'])
+        for rows in batches:
+            for row in rows:
+                writer.writerow([row.timestamp.isoformat(), row.user_message, row.ai_message])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    elif fmt == 'ndjson':
+        for rows in batches:
+            yield ''.join(json.dumps(export_record(row)) + '\n' for row in rows)
+    else:
+        # Same JSON array the endpoint always returned, just written out a batch at a time
+        separator = '['
+        for rows in batches:
+            yield separator + ','.join(json.dumps(export_record(row)) for row in rows)
+            separator = ','
+        yield '[]' if separator == '[' else ']'
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
 @app.route('/api/chats/export', methods=['GET'])
 @login_required
 def export_chats():
-    chats = Chat.query.filter_by(user_id=current_user.id).all()
-    return jsonify([{
-        'user_message': c.user_message,
-        'ai_message': c.ai_message,
-        'timestamp': c.timestamp.isoformat()
-    } for c in chats])
+    """Stream the current user's chats as JSON (default), NDJSON or CSV.
+
+    ?since= and ?until= take ISO timestamps (since inclusive, until exclusive) for
+    incremental exports; ?gzip=1 compresses the download on the fly.
+    """
+    fmt = request.args.get('format', 'json').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"Unsupported format. Use one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+        until = datetime.fromisoformat(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO 8601 timestamps'}), 400
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    chunks = render_export(fmt, iter_export_batches(current_user.id, since, until))
+    filename = f"echobot-chat-history-{datetime.utcnow().strftime('%Y-%m-%d')}.{extension}"
+    if request.args.get('gzip', 'false').lower() in ('1', 'true'):
+        chunks, mimetype, filename = gzip_stream(chunks), 'application/gzip', filename + '.gz'
+    headers = {'X-Accel-Buffering': 'no'}
+    if fmt != 'json' or mimetype == 'application/gzip':
+        # Plain JSON stays inline for clients that fetch() it; everything else is a download
+        headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
 
 @app.route('/api/chats/history', methods=['GET'])
 @login_required
 def get_chat_history():
-    """Get chat history for the current user only."""
+    """Get chat history for the current user only.
+
+    Pass ?before=<next_cursor> to page with a keyset cursor; ?offset= still works but
+    gets slower with depth. The exact total is only counted with ?include_total=1.
+    """
     try:
         # Get query parameters
         limit = min(request.args.get('limit', 50, type=int), 100)  # Max 100 chats
         offset = request.args.get('offset', 0, type=int)
+        try:
+            before = parse_chat_cursor(request.args['before']) if request.args.get('before') else None
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
         
         # Query only current user's chats
-        chats = Chat.query.filter_by(user_id=current_user.id)\
-                         .order_by(Chat.timestamp.desc())\
-                         .offset(offset)\
-                         .limit(limit)\
-                         .all()
+        if before is not None or not offset:
+            chats, next_cursor = user_chats_before(current_user.id, limit, before)
+        else:
+            chats = Chat.query.filter_by(user_id=current_user.id)\
+                             .order_by(Chat.timestamp.desc(), Chat.id.desc())\
+                             .offset(offset)\
+                             .limit(limit + 1)\
+                             .all()
+            next_cursor = chat_cursor(chats[limit - 1]) if len(chats) > limit else None
+            chats = chats[:limit]
         
-        total_chats = Chat.query.filter_by(user_id=current_user.id).count()
+        total_chats = Chat.query.filter_by(user_id=current_user.id).count() if wants_total() else None
         
         return jsonify({
             'chats': [{
@@ -505,6 +2735,8 @@ def get_chat_history():
             'total': total_chats,
             'limit': limit,
             'offset': offset,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None,
             'user_id': current_user.id  # For debugging (shows which user's chats these are)
         })
     except Exception as e:
@@ -515,22 +2747,18 @@ def get_chat_history():
 def get_user_stats():
     """Get statistics for the current user only."""
     try:
-        total_chats = Chat.query.filter_by(user_id=current_user.id).count()
-        total_files = UploadedFile.query.filter_by(user_id=current_user.id).count()
-        
-        # Get latest chat
-        latest_chat = Chat.query.filter_by(user_id=current_user.id)\
-                               .order_by(Chat.timestamp.desc())\
-                               .first()
-        
-        return jsonify({
-            'user_id': current_user.id,
-            'username': current_user.username,
-            'total_chats': total_chats,
-            'total_files': total_files,
-            'latest_chat_date': latest_chat.timestamp.isoformat() if latest_chat else None,
-            'joined_date': current_user.joined_date.isoformat() if current_user.joined_date else None
-        })
+        def build():
+            # Served from the denormalized counters on User instead of counting rows
+            total_chats, total_files, latest_chat_at = user_counters(current_user)
+            return {
+                'user_id': current_user.id,
+                'username': current_user.username,
+                'total_chats': total_chats,
+                'total_files': total_files,
+                'latest_chat_date': latest_chat_at.isoformat() if latest_chat_at else None,
+                'joined_date': current_user.joined_date.isoformat() if current_user.joined_date else None
+            }
+        return cached_user_payload('stats', build)
     except Exception as e:
         return jsonify({'error': 'Failed to fetch user statistics'}), 500
 
@@ -556,27 +2784,188 @@ def file_too_large(e): return jsonify({'error': 'File too large'}), 413
 def server_error(e): return jsonify({'error': 'Internal server error'}), 500
 
 # ========== RUN ==========
-with app.app_context():
+def ensure_schema():
+    """Add columns and indexes introduced after a table was first created.
+
+    db.create_all() only creates missing tables, so existing databases are brought
+    up to date here with nullable ALTER TABLE ... ADD COLUMN statements.
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+def ensure_chat_search_index():
+    """Create the FTS5 index over chat messages, kept in sync with the chat table by triggers"""
+    global chat_fts_enabled
+    if db.engine.dialect.name != 'sqlite':
+        return
+    try:
+        with db.engine.begin() as conn:
+            exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'chat_fts'")).first()
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5("
+                "user_message, ai_message, content='chat', content_rowid='id', tokenize='porter unicode61')"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS chat_fts_insert AFTER INSERT ON chat BEGIN "
+                "INSERT INTO chat_fts(rowid, user_message, ai_message) VALUES (new.id, new.user_message, new.ai_message); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS chat_fts_delete AFTER DELETE ON chat BEGIN "
+                "INSERT INTO chat_fts(chat_fts, rowid, user_message, ai_message) "
+                "VALUES ('delete', old.id, old.user_message, old.ai_message); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS chat_fts_update AFTER UPDATE ON chat BEGIN "
+                "INSERT INTO chat_fts(chat_fts, rowid, user_message, ai_message) "
+                "VALUES ('delete', old.id, old.user_message, old.ai_message); "
+                "INSERT INTO chat_fts(rowid, user_message, ai_message) VALUES (new.id, new.user_message, new.ai_message); END"
+            ))
+            if not exists:
+                # Weight matches in the user's own message above the AI answer
+                conn.execute(text("INSERT INTO chat_fts(chat_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0)')"))
+                # Index chats written before the FTS table existed
+                conn.execute(text("INSERT INTO chat_fts(chat_fts) VALUES ('rebuild')"))
+        chat_fts_enabled = True
+    except Exception as e:
+        print(f"Full-text chat search unavailable, falling back to LIKE: {e}")
+
+def init_db():
+    """Create missing tables, then bring older ones up to date and set up chat search"""
     db.create_all()
+    ensure_schema()
+    ensure_chat_search_index()
+
+# Run once per deploy (build.sh, the Procfile's release phase) rather than by every worker on import
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the database schema and the chat search index"""
+    init_db()
+    click.echo('Database ready')
+
+def reset_after_fork():
+    """Drop connections and pools inherited from the parent process.
+
+    With gunicorn --preload the app is imported once and every worker is forked from that
+    process; sockets it opened must not be shared. dispose(close=False) leaves the parent's
+    connections alone and gives the child an empty pool.
+    """
+    global extraction_pool
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    gemini_session.close()
+    extraction_pool = None
 
-from flask import send_from_directory
+os.register_at_fork(after_in_child=reset_after_fork)
+
+from flask import send_file
+
+# ========== MEDIA ==========
+static_versions = {}
+
+def static_version(filename):
+    """Short content hash of a static file, recomputed when its mtime changes"""
+    path = safe_join(app.static_folder, filename)
+    if not path or not os.path.isfile(path):
+        return None
+    key = (filename, os.stat(path).st_mtime_ns)
+    if key not in static_versions:
+        with open(path, 'rb') as f:
+            static_versions[key] = hashlib.sha256(f.read()).hexdigest()[:12]
+    return static_versions[key]
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    # url_for('static', ...) URLs change whenever the file does, so they can be cached for good
+    if endpoint == 'static' and 'v' not in values:
+        version = static_version(values.get('filename', ''))
+        if version:
+            values['v'] = version
+
+@app.after_request
+def cache_static_assets(response):
+    """Long-lived caching for fingerprinted static URLs and avatars, whose names change with their content"""
+    if request.endpoint == 'static' and response.status_code in (200, 206, 304):
+        filename = (request.view_args or {}).get('filename', '')
+        if request.args.get('v') or filename.startswith('avatars/'):
+            response.headers['Cache-Control'] = f"public, max-age={app.config['STATIC_MAX_AGE']}, immutable"
+    return response
+
+def send_media(filepath, download_name, etag=True):
+    """Send an uploaded file with ETag/Last-Modified revalidation and Range support.
+
+    With MEDIA_OFFLOAD=x-accel only headers are returned and nginx sends the file (and
+    answers Range and conditional requests itself); x-sendfile works the same way through
+    Flask's USE_X_SENDFILE.
+    """
+    if app.config['MEDIA_OFFLOAD'] == 'x-accel':
+        relative = os.path.relpath(filepath, app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+        response = app.response_class(mimetype=mimetypes.guess_type(download_name)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = app.config['MEDIA_ACCEL_PREFIX'].rstrip('/') + '/' + quote(relative)
+        response.headers.set('Content-Disposition', 'inline', filename=download_name)
+    else:
+        response = send_file(filepath, download_name=download_name, etag=etag, conditional=True)
+    # Private to the signed-in user; revalidated each time, which is a 304 while unchanged
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/api/files', methods=['GET'])
 @login_required
 def list_user_files():
-    user_files = UploadedFile.query.filter_by(user_id=current_user.id).order_by(UploadedFile.uploaded_at.desc()).all()
+    # Preview and length come from the blob's columns; text not yet moved by `flask compact-file-text`
+    # is cut and measured by the database instead of being loaded whole
+    legacy_text = func.coalesce(FileBlob.legacy_text, UploadedFile.legacy_text)
+    rows = db.session.execute(
+        db.select(
+            UploadedFile,
+            func.coalesce(FileBlob.preview, func.substr(legacy_text, 1, TEXT_PREVIEW_CHARS), ''),
+            func.coalesce(FileBlob.text_length, func.length(legacy_text), 0)
+        )
+        .outerjoin(UploadedFile.blob)
+        .options(db.contains_eager(UploadedFile.blob))
+        .filter(UploadedFile.user_id == current_user.id)
+        .order_by(UploadedFile.uploaded_at.desc())
+    ).all()
     return jsonify([{
         'id': f.id,
         'filename': f.filename,
         'uploaded_at': f.uploaded_at.isoformat(),
-        'extracted_text': f.extracted_text[:500] + ('...' if len(f.extracted_text) > 500 else '')
-    } for f in user_files])
+        'status': f.status,
+        'extracted_text': preview + ('...' if text_length > TEXT_PREVIEW_CHARS else '')
+    } for f, preview, text_length in rows])
 
 @app.route('/media/<int:user_id>/<filename>')
 @login_required
 def serve_user_file(user_id, filename):
-    user_upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], str(user_id))
-    return send_from_directory(user_upload_dir, filename)
+    if user_id != current_user.id:
+        return jsonify({'error': 'File not found'}), 404
+    uploaded_file = UploadedFile.query.filter_by(user_id=user_id, filename=filename)\
+                                      .order_by(UploadedFile.uploaded_at.desc())\
+                                      .first()
+    if uploaded_file and uploaded_file.blob:
+        if not os.path.isfile(uploaded_file.blob.filepath):
+            # Older uploads whose file was lost keep only their text
+            return jsonify({'error': 'File not found'}), 404
+        # Blobs are content-addressed, so their hash is a strong ETag
+        return send_media(uploaded_file.blob.filepath, filename, etag=uploaded_file.blob.sha256)
+    # Uploads stored before content-addressed blobs
+    filepath = safe_join(os.path.join(app.config['UPLOAD_FOLDER'], str(user_id)), filename)
+    if not filepath or not os.path.isfile(filepath):
+        return jsonify({'error': 'File not found'}), 404
+    return send_media(filepath, filename)
 
 if __name__ == '__main__':
+    # The development server sets up its own database; deployments run `flask --app app init-db`
+    with app.app_context():
+        init_db()
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=os.environ.get('DEBUG', 'false').lower() == 'true')
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""Compare LIKE scanning with the FTS5 index for /api/chats/search.
+
+Seeds a throwaway SQLite database with a large generated chat history (triggers keep the
+FTS index in sync while seeding), then times the search endpoint with FTS on and off:
+
+    python bench/chat_search.py --chats 50000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+WORKDIR = tempfile.mkdtemp(prefix='echobot-bench-')
+os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}", UPLOAD_FOLDER=os.path.join(WORKDIR, 'uploads'))
+
+import app as echobot  # noqa: E402
+
+with echobot.app.app_context():
+    echobot.init_db()
+
+# Zipf-distributed synthetic vocabulary, so a few words are everywhere and most are rare
+VOCABULARY = [f"{a}{b}{c}" for a in 'bcdfgklmnprstvz' for b in ('a', 'e', 'i', 'o', 'u', 'ai', 'ou') for c in ('n', 'r', 'st', 'lk', 'mp', 'th', 'x', 'ng', 'ck', 'rd')]
+WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+QUERIES = [VOCABULARY[0], VOCABULARY[5] + ' ' + VOCABULARY[40], VOCABULARY[300], VOCABULARY[900][:3], 'nonexistentword']
+
+
+def sentence(rng, words=14):
+    return ' '.join(rng.choices(VOCABULARY, WEIGHTS, k=words)).capitalize() + '.'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app, db = echobot.app, echobot.db
+    rng = random.Random(42)
+    client = app.test_client()
+    client.environ_base['wsgi.url_scheme'] = 'https'
+    client.post('/api/auth/signup', json={'username': 'bench_user', 'email': 'bench@bench.local', 'password': 'benchmark-pw'})
+    client.post('/api/auth/login', json={'username': 'bench_user', 'password': 'benchmark-pw'})
+
+    started = time.perf_counter()
+    with app.app_context():
+        user_id = echobot.User.query.filter_by(username='bench_user').one().id
+        now = datetime.utcnow()
+        for batch_start in range(0, args.chats, 5000):
+            db.session.execute(db.insert(echobot.Chat), [{
+                'user_id': user_id,
+                'user_message': sentence(rng),
+                'ai_message': ' '.join(sentence(rng) for _ in range(6)),
+                'timestamp': now - timedelta(minutes=i)
+            } for i in range(batch_start, min(batch_start + 5000, args.chats))])
+            db.session.commit()
+    print(f"seeded {args.chats} chats in {time.perf_counter() - started:.1f}s (FTS enabled: {echobot.chat_fts_enabled})")
+
+    with app.app_context():
+        matches = {query: echobot.Chat.query.filter(echobot.Chat.user_message.contains(query) | echobot.Chat.ai_message.contains(query)).count()
+                   for query in QUERIES}
+    print(f"  {'query':<18} {'rows':>7} {'LIKE ms':>9} {'FTS5 ms':>9}")
+    for query in QUERIES:
+        medians = []
+        for fts in (False, True):
+            echobot.chat_fts_enabled = fts
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                client.get('/api/chats/search', query_string={'q': query}).get_json()
+                timings.append((time.perf_counter() - started) * 1000)
+            medians.append(statistics.median(timings))
+        print(f"  {query:<18} {matches[query]:>7} {medians[0]:>9.1f} {medians[1]:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Measure memory and time-to-first-byte of /api/chats/export.
+
+Seeds a throwaway SQLite database with N chats, then exports them with:
+  list     - the original path: load every Chat and jsonify one list
+  <format> - the streaming formats, consumed chunk by chunk like a download
+
+Python heap peaks are taken with tracemalloc:
+
+    python bench/export.py --chats 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+WORKDIR = tempfile.mkdtemp(prefix='echobot-bench-')
+os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}", UPLOAD_FOLDER=os.path.join(WORKDIR, 'uploads'))
+
+import app as echobot  # noqa: E402
+from flask import jsonify  # noqa: E402
+
+with echobot.app.app_context():
+    echobot.init_db()
+
+
+def old_export(user_id):
+    chats = echobot.Chat.query.filter_by(user_id=user_id).all()
+    return jsonify([{
+        'user_message': c.user_message,
+        'ai_message': c.ai_message,
+        'timestamp': c.timestamp.isoformat()
+    } for c in chats]).get_data()
+
+
+def measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    first_byte, size = fn(started)
+    total = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first_byte * 1000, total, size, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=100000)
+    args = parser.parse_args()
+
+    app, db = echobot.app, echobot.db
+    client = app.test_client()
+    client.environ_base['wsgi.url_scheme'] = 'https'
+    client.post('/api/auth/signup', json={'username': 'bench_user', 'email': 'bench@bench.local', 'password': 'benchmark-pw'})
+    client.post('/api/auth/login', json={'username': 'bench_user', 'password': 'benchmark-pw'})
+
+    with app.app_context():
+        user_id = echobot.User.query.filter_by(username='bench_user').one().id
+        now = datetime.utcnow()
+        for batch_start in range(0, args.chats, 5000):
+            db.session.execute(db.insert(echobot.Chat), [{
+                'user_id': user_id,
+                'user_message': f'Question number {i} about something ' * 3,
+                'ai_message': f'Answer number {i}, with a few sentences of detail. ' * 12,
+                'timestamp': now - timedelta(minutes=i)
+            } for i in range(batch_start, min(batch_start + 5000, args.chats))])
+            db.session.commit()
+
+    def run_old(started):
+        with app.test_request_context():
+            body = old_export(user_id)
+        return time.perf_counter() - started, len(body)
+
+    def run_stream(query):
+        def run(started):
+            response = client.get('/api/chats/export', query_string=query, buffered=False)
+            first_byte, size = None, 0
+            for chunk in response.response:
+                first_byte = first_byte or time.perf_counter() - started
+                size += len(chunk)
+            response.close()
+            return first_byte, size
+        return run
+
+    print(f"{args.chats} chats, EXPORT_BATCH_SIZE={app.config['EXPORT_BATCH_SIZE']}")
+    print(f"  {'export':<12} {'first byte':>11} {'total':>8} {'size':>9} {'peak heap':>10}")
+    cases = [('list', run_old), ('json', run_stream({})), ('ndjson', run_stream({'format': 'ndjson'})),
+             ('csv', run_stream({'format': 'csv'})), ('ndjson.gz', run_stream({'format': 'ndjson', 'gzip': 1}))]
+    for label, fn in cases:
+        first_byte, total, size, peak = measure(fn)
+        print(f"  {label:<12} {first_byte:>8.0f} ms {total:>7.2f}s {size / 1024 / 1024:>7.1f}MB {peak:>8.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
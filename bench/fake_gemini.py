@@ -0,0 +1,126 @@
+"""Local stand-in for the Gemini REST API.
+
+Answers `:generateContent` with a single JSON body and `:streamGenerateContent?alt=sse`
+with chunked Server-Sent Events, so the app can be exercised without a real API key:
+
+    python bench/fake_gemini.py --port 8081 --latency 0.5
+    GEMINI_API_BASE=http://127.0.0.1:8081/v1 GEMINI_API_KEY=fake python app.py
+
+Faults for exercising the app's retries, circuit breaker and timeouts:
+  --error-rate      share of requests that fail with --error-status (plus a Retry-After
+                    header when --retry-after is given)
+  --reset-rate      share of requests whose connection is dropped without an answer
+  --hang-rate       share of requests that stall for --hang-seconds before answering
+  --outage START:END  every request fails between these seconds after startup
+
+--seed makes the sequence of failures repeatable between runs:
+
+    python bench/fake_gemini.py --error-rate 0.3 --error-status 429 --retry-after 1 --seed 7
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(latency, chunks, chunk_delay, latency_per_kb=0.0, error_rate=0.0, error_status=503, seed=None,
+                 retry_after=None, reset_rate=0.0, hang_rate=0.0, hang_seconds=60.0, outage=None):
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    started = time.monotonic()
+
+    class FakeGeminiHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _candidate(self, text):
+            return {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}}]}
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            prompt = body.get('contents', [{}])[-1].get('parts', [{}])[0].get('text', '')
+            words = f"Echo: {prompt[:200]}".split(' ')
+            time.sleep(latency + latency_per_kb * len(prompt) / 1024)
+
+            with rng_lock:
+                roll = rng.random()
+            down = outage is not None and outage[0] <= time.monotonic() - started < outage[1]
+            if not down and error_rate <= roll < error_rate + reset_rate:
+                self.close_connection = True
+                return
+            if not down and error_rate + reset_rate <= roll < error_rate + reset_rate + hang_rate:
+                time.sleep(hang_seconds)
+            if down or roll < error_rate:
+                status = 503 if down else error_status
+                payload = json.dumps({'error': {'code': status, 'message': 'Injected failure',
+                                                'status': 'RESOURCE_EXHAUSTED' if status == 429 else 'UNAVAILABLE'}}).encode('utf-8')
+                self.send_response(status)
+                if retry_after is not None:
+                    self.send_header('Retry-After', str(retry_after))
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+
+            if ':streamGenerateContent' in self.path:
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                step = max(1, len(words) // chunks)
+                for i in range(0, len(words), step):
+                    piece = ' '.join(words[i:i + step]) + (' ' if i + step < len(words) else '')
+                    event = f"data: {json.dumps(self._candidate(piece))}\r\n\r\n".encode('utf-8')
+                    self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+                    self.wfile.flush()
+                    time.sleep(chunk_delay)
+                self.wfile.write(b"0\r\n\r\n")
+                return
+
+            payload = json.dumps(self._candidate(' '.join(words))).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return FakeGeminiHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before the first byte')
+    parser.add_argument('--chunks', type=int, default=8, help='number of SSE chunks per streamed answer')
+    parser.add_argument('--chunk-delay', type=float, default=0.05, help='seconds between streamed chunks')
+    parser.add_argument('--latency-per-kb', type=float, default=0.0, help='extra seconds per KB of prompt, like real model prefill')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests that fail, 0-1')
+    parser.add_argument('--error-status', type=int, default=503, help='HTTP status of injected failures')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the failure sequence')
+    parser.add_argument('--retry-after', default=None, help='Retry-After header sent with injected failures, seconds or an HTTP date')
+    parser.add_argument('--reset-rate', type=float, default=0.0, help='share of requests whose connection is dropped, 0-1')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='share of requests that stall before answering, 0-1')
+    parser.add_argument('--hang-seconds', type=float, default=60.0, help='how long stalled requests stall')
+    parser.add_argument('--outage', default=None, help='START:END seconds after startup during which every request fails with 503')
+    args = parser.parse_args()
+    outage = tuple(float(bound) for bound in args.outage.split(':')) if args.outage else None
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(
+        args.latency, args.chunks, args.chunk_delay, args.latency_per_kb, args.error_rate, args.error_status, args.seed,
+        args.retry_after, args.reset_rate, args.hang_rate, args.hang_seconds, outage))
+    print(f"Fake Gemini listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
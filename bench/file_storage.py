@@ -0,0 +1,115 @@
+"""Measure database size and GET /api/files latency before and after compacting file text.
+
+Seeds a throwaway SQLite database with one user owning many large extracted documents in
+the old layout (uncompressed text on file_blob plus a per-page copy in blob_page), then:
+  before - the old listing, which loaded every document's full text to cut a 500-char preview
+  after  - `flask compact-file-text --vacuum`, then the preview-column listing
+
+    python bench/file_storage.py --files 200 --pages 40
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+WORKDIR = tempfile.mkdtemp(prefix='echobot-bench-')
+DB_PATH = os.path.join(WORKDIR, 'bench.db')
+os.environ.update(DATABASE_URL=f"sqlite:///{DB_PATH}", UPLOAD_FOLDER=os.path.join(WORKDIR, 'uploads'))
+
+import app as echobot  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+with echobot.app.app_context():
+    echobot.init_db()
+
+VOCABULARY = [f"{a}{b}{c}" for a in 'bcdfgklmnprstvz' for b in ('a', 'e', 'i', 'o', 'u', 'ai', 'ou') for c in ('n', 'r', 'st', 'lk', 'mp', 'th', 'x', 'ng', 'ck', 'rd')]
+WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+
+
+def page_text(rng, words=600):
+    return ' '.join(rng.choices(VOCABULARY, WEIGHTS, k=words))
+
+
+def old_list(user_id):
+    """The listing before preview columns: full text loaded per file just to slice it"""
+    files = echobot.UploadedFile.query.filter_by(user_id=user_id)\
+        .options(echobot.db.joinedload(echobot.UploadedFile.blob).undefer(echobot.FileBlob.legacy_text))\
+        .order_by(echobot.UploadedFile.uploaded_at.desc()).all()
+    return [{
+        'id': f.id,
+        'filename': f.filename,
+        'uploaded_at': f.uploaded_at.isoformat(),
+        'status': f.status,
+        'extracted_text': (f.blob.legacy_text or '')[:500] + ('...' if len(f.blob.legacy_text or '') > 500 else '')
+    } for f in files]
+
+
+def vacuum():
+    with echobot.db.engine.connect() as conn:
+        conn.execute(text('VACUUM'))
+    return os.path.getsize(DB_PATH) / 1024 / 1024
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--pages', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app, db = echobot.app, echobot.db
+    rng = random.Random(42)
+    client = app.test_client()
+    client.environ_base['wsgi.url_scheme'] = 'https'
+    client.post('/api/auth/signup', json={'username': 'bench_user', 'email': 'bench@bench.local', 'password': 'benchmark-pw'})
+    client.post('/api/auth/login', json={'username': 'bench_user', 'password': 'benchmark-pw'})
+
+    with app.app_context():
+        user_id = echobot.User.query.filter_by(username='bench_user').one().id
+        for number in range(args.files):
+            sha256 = f'{number:064x}'
+            pages = [page_text(rng) for _ in range(args.pages)]
+            blob = echobot.FileBlob(sha256=sha256, filepath=f'/nonexistent/{sha256}.pdf', filetype='pdf', filesize=0,
+                                    status='ready', page_count=args.pages, pages_done=args.pages)
+            db.session.add(blob)
+            db.session.add(echobot.UploadedFile(user_id=user_id, filename=f'document-{number}.pdf', filepath=blob.filepath,
+                                                filetype='pdf', filesize=0, blob_sha256=sha256))
+            rows = [{'blob_sha256': sha256, 'page_number': i + 1, 'text': page} for i, page in enumerate(pages)]
+            db.session.execute(db.insert(echobot.BlobPage), rows)
+            db.session.commit()
+            echobot.index_blob(blob)  # drops the page rows, so put them back as older versions kept them
+            db.session.execute(db.insert(echobot.BlobPage), rows)
+            db.session.execute(text('UPDATE file_blob SET extracted_text = :text WHERE sha256 = :sha256'),
+                               {'text': echobot.join_pdf_pages(pages), 'sha256': sha256})
+            db.session.commit()
+        db.session.remove()
+
+        size_before = vacuum()
+        before_ms = timed(lambda: old_list(user_id), args.repeat)
+        db.session.remove()
+
+        compacted, _, pages_deleted = echobot.compact_blob_text()
+        db.session.remove()
+        size_after = vacuum()
+
+    after_ms = timed(lambda: client.get('/api/files').get_json(), args.repeat)
+    print(f"{args.files} files x {args.pages} pages, compacted {compacted} blobs, removed {pages_deleted} page rows")
+    print(f"  database size   {size_before:8.1f} MB -> {size_after:8.1f} MB ({size_after / size_before:.0%})")
+    print(f"  GET /api/files  {before_ms:8.1f} ms -> {after_ms:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""Seeded load benchmark: run scripted workloads against gunicorn and write per-endpoint latency to JSON.
+
+Seeds a throwaway SQLite database (users, a long chat history each, large extracted
+documents), starts bench/fake_gemini.py and the app under gunicorn, then drives a weighted
+mix of workloads from --concurrency client threads for --duration seconds:
+
+  chat     POST /api/ai/chat, continuing a conversation and sometimes asking about a file
+  stream   POST /api/ai/chat/stream, read to the end
+  history  GET /api/chats, following next_cursor for a few pages
+  export   GET /api/chats/export?format=ndjson, read to the end
+  upload   POST /api/files with a generated PNG, then poll until OCR has finished
+  profile  GET /api/profile and /api/user/stats, revalidating with If-None-Match
+  search   GET /api/chats/search
+
+Throughput and p50/p95/p99 per endpoint go to --out; --compare prints the change from an
+earlier run. The same --seed gives the same data, request mix and Gemini failures:
+
+    python bench/harness.py --duration 30 --out before.json
+    python bench/harness.py --duration 30 --out after.json --compare before.json
+"""
+import argparse
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import requests
+from PIL import Image, ImageDraw
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path[:0] = [ROOT, BENCH_DIR]
+
+from load_test import percentile, wait_for  # noqa: E402
+
+VOCABULARY = [f"{a}{b}{c}" for a in 'bcdfgklmnprstvz' for b in ('a', 'e', 'i', 'o', 'u', 'ai', 'ou') for c in ('n', 'r', 'st', 'lk', 'mp', 'th', 'x', 'ng', 'ck', 'rd')]
+WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+PASSWORD = 'benchmark-pw'
+DEFAULT_MIX = 'chat=4,stream=2,history=3,profile=3,search=1,export=1,upload=1'
+
+
+def words(rng, count):
+    return ' '.join(rng.choices(VOCABULARY, WEIGHTS, k=count))
+
+
+def seed_database(args, workdir):
+    """Fill the benchmark database through the app's models before gunicorn starts"""
+    os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}", UPLOAD_FOLDER=os.path.join(workdir, 'uploads'))
+    import app as echobot
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(args.seed)
+    app, db = echobot.app, echobot.db
+    started = time.perf_counter()
+    with app.app_context():
+        echobot.init_db()
+        password_hash = generate_password_hash(PASSWORD)
+        now = datetime.utcnow()
+        for number in range(args.users):
+            user = echobot.User(username=f'bench_{number}', email=f'bench_{number}@bench.local', password_hash=password_hash)
+            db.session.add(user)
+            db.session.flush()
+
+            chats, conversation_id, turns_left = [], None, 0
+            for i in range(args.chats_per_user):
+                if turns_left == 0:
+                    conversation_id, turns_left = str(uuid.UUID(int=rng.getrandbits(128))), rng.randint(1, 8)
+                turns_left -= 1
+                chats.append({
+                    'user_id': user.id,
+                    'user_message': words(rng, rng.randint(5, 40)).capitalize() + '?',
+                    'ai_message': '. '.join(words(rng, rng.randint(8, 20)).capitalize() for _ in range(rng.randint(2, 12))) + '.',
+                    'timestamp': now - timedelta(days=90) * (1 - i / args.chats_per_user),
+                    'conversation_id': conversation_id,
+                })
+            db.session.execute(db.insert(echobot.Chat), chats)
+
+            for file_number in range(args.files_per_user):
+                sha256 = f'{number:032x}{file_number:032x}'
+                blob = echobot.FileBlob(sha256=sha256, filepath=os.path.join(workdir, 'missing', f'{sha256}.pdf'), filetype='pdf',
+                                        filesize=args.file_kb * 1024, status='ready')
+                blob.extracted_text = words(rng, args.file_kb * 1024 // 7)
+                db.session.add(blob)
+                db.session.add(echobot.UploadedFile(user_id=user.id, filename=f'document-{file_number}.pdf', filepath=blob.filepath,
+                                                    filetype='pdf', filesize=blob.filesize, blob_sha256=sha256))
+                db.session.commit()
+                echobot.index_blob(blob)
+            db.session.commit()
+        echobot.recompute_user_counters()
+        db.session.commit()
+    print(f"seeded {args.users} users x {args.chats_per_user} chats, {args.files_per_user} x {args.file_kb} KB files "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+def png_upload(rng):
+    """A small text image, with a few random pixels so every upload is new content"""
+    image = Image.new('L', (640, 160), color=255)
+    draw = ImageDraw.Draw(image)
+    for line in range(4):
+        draw.text((10, 10 + line * 35), words(rng, 8), fill=0)
+    for _ in range(20):
+        image.putpixel((rng.randrange(640), rng.randrange(160)), rng.randrange(256))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class Client:
+    """One simulated user: a keep-alive session plus the state scripted workloads carry over"""
+
+    def __init__(self, base, username, rng, record):
+        self.base, self.rng, self.record = base, rng, record
+        self.http = requests.Session()
+        response = self.http.post(f"{base}/api/auth/login", json={'username': username, 'password': PASSWORD})
+        response.raise_for_status()
+        # The session cookie is marked Secure, so it is forwarded by hand over plain HTTP
+        self.http.headers['Cookie'] = f"session={response.cookies['session']}"
+        self.conversation_id = None
+        self.file_ids = [f['id'] for f in self.http.get(f"{base}/api/files").json()]
+        self.etags = {}
+
+    def call(self, label, method, path, read=True, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, f"{self.base}{path}", timeout=120, stream=not read, **kwargs)
+            if not read:
+                for _ in response.iter_content(64 * 1024):
+                    pass
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        self.record(label, (time.perf_counter() - started) * 1000, ok)
+        return response
+
+    def chat(self):
+        if self.conversation_id is None or self.rng.random() < 0.2:
+            self.conversation_id = None
+        body = {'message': words(self.rng, self.rng.randint(5, 30)) + '?', 'conversation_id': self.conversation_id}
+        if self.file_ids and self.rng.random() < 0.3:
+            body['file_id'] = self.rng.choice(self.file_ids)
+        response = self.call('POST /api/ai/chat', 'POST', '/api/ai/chat', json=body)
+        if response is not None and response.ok:
+            self.conversation_id = response.json().get('conversation_id')
+
+    def stream(self):
+        self.call('POST /api/ai/chat/stream', 'POST', '/api/ai/chat/stream', read=False,
+                  json={'message': words(self.rng, self.rng.randint(5, 30)) + '?'})
+
+    def history(self, pages=5):
+        cursor = None
+        for _ in range(self.rng.randint(1, pages)):
+            params = {'per_page': 20, 'preview': 1}
+            if cursor:
+                params['before'] = cursor
+            response = self.call('GET /api/chats', 'GET', '/api/chats', params=params)
+            if response is None or not response.ok:
+                return
+            cursor = response.json().get('next_cursor')
+            if not cursor:
+                return
+
+    def export(self):
+        self.call('GET /api/chats/export', 'GET', '/api/chats/export', read=False, params={'format': 'ndjson'})
+
+    def upload(self):
+        started = time.perf_counter()
+        response = self.call('POST /api/files', 'POST', '/api/files',
+                             files={'file': (f'scan-{self.rng.getrandbits(32):08x}.png', png_upload(self.rng), 'image/png')})
+        if response is None or response.status_code not in (201, 202):
+            return
+        file_id = response.json()['file_id']
+        status = response.json().get('status')
+        while status == 'pending' and time.perf_counter() - started < 60:
+            time.sleep(0.1)
+            status = self.http.get(f"{self.base}/api/files/{file_id}/status").json().get('status')
+        self.record('upload until extracted', (time.perf_counter() - started) * 1000, status in ('ready', 'failed'))
+
+    def profile(self):
+        for path in ('/api/profile', '/api/user/stats'):
+            headers = {'If-None-Match': self.etags[path]} if path in self.etags else {}
+            response = self.call(f'GET {path}', 'GET', path, headers=headers)
+            if response is not None and response.headers.get('ETag'):
+                self.etags[path] = response.headers['ETag']
+
+    def search(self):
+        self.call('GET /api/chats/search', 'GET', '/api/chats/search', params={'q': self.rng.choice(VOCABULARY[:200])})
+
+
+def parse_mix(spec):
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        if not hasattr(Client, name.strip()):
+            raise SystemExit(f"unknown workload: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def stage_summary(metrics_text):
+    """Mean time per stage from the app's /metrics histograms"""
+    sums, counts = {}, {}
+    for match in re.finditer(r'^echobot_stage_duration_seconds_(sum|count)\{stage="(\w+)"\} ([0-9.e+-]+)$', metrics_text, re.M):
+        (sums if match.group(1) == 'sum' else counts)[match.group(2)] = float(match.group(3))
+    return {stage: {'count': int(counts[stage]), 'mean_ms': round(sums[stage] / counts[stage] * 1000, 2)}
+            for stage in sorted(counts) if counts[stage]}
+
+
+def summarize(samples, duration):
+    results = {}
+    for label, entries in sorted(samples.items()):
+        latencies = [ms for ms, _ in entries]
+        results[label] = {
+            'count': len(entries),
+            'errors': sum(1 for _, ok in entries if not ok),
+            'throughput_rps': round(len(entries) / duration, 2),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(max(latencies), 2),
+        }
+    return results
+
+
+def print_report(report, baseline=None):
+    print(f"  {'endpoint':<28} {'count':>6} {'err':>4} {'req/s':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for label, row in report['endpoints'].items():
+        line = (f"  {label:<28} {row['count']:>6} {row['errors']:>4} {row['throughput_rps']:>7.1f} "
+                f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+        old = (baseline or {}).get('endpoints', {}).get(label)
+        if old:
+            line += '   p50 {:+.0%}  p95 {:+.0%}'.format(*(
+                (row[key] - old[key]) / old[key] if old[key] else 0 for key in ('p50_ms', 'p95_ms')))
+        print(line)
+    for stage, row in report['stages'].items():
+        print(f"  stage {stage:<22} {row['count']:>6} mean {row['mean_ms']:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--chats-per-user', type=int, default=2000)
+    parser.add_argument('--files-per-user', type=int, default=3)
+    parser.add_argument('--file-kb', type=int, default=200, help='extracted text per seeded file')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='workload weights, e.g. chat=4,history=3')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--gemini-latency', type=float, default=0.5)
+    parser.add_argument('--gemini-chunks', type=int, default=8)
+    parser.add_argument('--gemini-chunk-delay', type=float, default=0.05)
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--out', default='bench-results.json')
+    parser.add_argument('--compare', help='earlier --out file to compare against')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix='echobot-bench-')
+    seed_database(args, workdir)
+
+    gemini_port = args.port + 1
+    base = f"http://127.0.0.1:{args.port}"
+    env = dict(
+        os.environ,
+        PORT=str(args.port),
+        GEMINI_API_BASE=f"http://127.0.0.1:{gemini_port}/v1",
+        GEMINI_API_KEY='fake',
+        WEB_CONCURRENCY=str(args.workers),
+        GUNICORN_THREADS=str(args.threads),
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, 'metrics'),
+    )
+    procs = [
+        subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'fake_gemini.py'), '--port', str(gemini_port),
+                          '--latency', str(args.gemini_latency), '--chunks', str(args.gemini_chunks),
+                          '--chunk-delay', str(args.gemini_chunk_delay), '--error-rate', str(args.gemini_error_rate),
+                          '--seed', str(args.seed)]),
+        subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'], cwd=ROOT, env=env),
+    ]
+    try:
+        wait_for(f"{base}/login", timeout=30)
+        samples = defaultdict(list)
+        samples_lock = threading.Lock()
+
+        def record(label, ms, ok):
+            with samples_lock:
+                samples[label].append((ms, ok))
+
+        names, weights = list(mix), list(mix.values())
+        clients = [Client(base, f'bench_{i % args.users}', random.Random(args.seed + i), record) for i in range(args.concurrency)]
+        deadline = time.time() + args.duration
+
+        def drive(client):
+            while time.time() < deadline:
+                getattr(client, client.rng.choices(names, weights)[0])()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=drive, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        report = {
+            'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'git_commit': commit or None,
+            'config': vars(args),
+            'duration_s': round(elapsed, 2),
+            'endpoints': summarize(samples, elapsed),
+            'stages': stage_summary(requests.get(f"{base}/metrics").text),
+        }
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            proc.wait()
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(f"{args.concurrency} clients for {report['duration_s']}s against {args.workers}x{args.threads} gunicorn, "
+          f"results in {args.out}")
+    print_report(report, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Time `import app` in a fresh interpreter, as every gunicorn worker boot or restart pays it.
+
+Each run starts a new Python process against a database whose schema already exists and
+times the import alone, then reports which of the heavy extraction modules it loaded.
+--baseline also times app.py from an earlier git revision (in a temp copy of the tree),
+so a change can be compared with what came before:
+
+    python bench/import_time.py --runs 10 --baseline HEAD~1
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('PyPDF2', 'PIL.Image', 'pytesseract')
+
+PROBE = f"""
+import json, sys, time
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+SETUP = """
+import app
+if hasattr(app, 'init_db'):
+    with app.app.app_context():
+        app.init_db()
+"""
+
+
+def checkout(revision, workdir):
+    """A copy of the tree with app.py as it was at revision"""
+    tree = os.path.join(workdir, 'baseline')
+    shutil.copytree(ROOT, tree, ignore=shutil.ignore_patterns('.git', 'instance', 'uploads', '__pycache__'))
+    source = subprocess.run(['git', 'show', f'{revision}:app.py'], cwd=ROOT, check=True, capture_output=True).stdout
+    with open(os.path.join(tree, 'app.py'), 'wb') as f:
+        f.write(source)
+    return tree
+
+
+def prepare(label, tree, workdir):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, label + '.db')}",
+               UPLOAD_FOLDER=os.path.join(workdir, 'uploads'))
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    # Older versions create the schema while importing; newer ones through init_db(). This
+    # also leaves compiled bytecode behind, as a deployed tree has.
+    subprocess.run([sys.executable, '-c', SETUP], cwd=tree, env=env, check=True, capture_output=True)
+    return env
+
+
+def probe(tree, env):
+    result = subprocess.run([sys.executable, '-c', PROBE], cwd=tree, env=env, check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--baseline', default=None, help='git revision to compare against, e.g. HEAD~1')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='echobot-bench-')
+    print(f"`import app`, {args.runs} fresh interpreters each (ms)")
+    print(f"  {'tree':<10} {'median':>8} {'min':>8} {'max':>8}  extraction modules loaded")
+    try:
+        trees = {'current': ROOT}
+        if args.baseline:
+            trees = {'baseline': checkout(args.baseline, workdir), **trees}
+        envs = {label: prepare(label, tree, workdir) for label, tree in trees.items()}
+        samples, loaded = {label: [] for label in trees}, {}
+        # Alternate the trees so drift in machine load hits both alike
+        for _ in range(args.runs):
+            for label, tree in trees.items():
+                result = probe(tree, envs[label])
+                samples[label].append(result['seconds'] * 1000)
+                loaded[label] = result['loaded']
+        for label, values in samples.items():
+            print(f"  {label:<10} {statistics.median(values):>8.0f} {min(values):>8.0f} {max(values):>8.0f}  {', '.join(loaded[label]) or '-'}")
+        if args.baseline:
+            before, after = statistics.median(samples['baseline']), statistics.median(samples['current'])
+            print(f"  change: {after - before:+.0f} ms ({(after - before) / before:+.0%})")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
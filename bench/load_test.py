@@ -0,0 +1,128 @@
+"""Check that cheap routes stay fast while slow AI calls are in flight.
+
+Starts bench/fake_gemini.py with a fixed latency and the app under gunicorn against a
+throwaway SQLite database, keeps N `/api/ai/chat` requests busy, and measures
+`/api/profile` and `/api/chats` latency at the same time:
+
+    python bench/load_test.py --worker-class sync --threads 1
+    python bench/load_test.py --worker-class gthread --threads 8
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for(url, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def init_db(env):
+    """Create the schema the way a deploy does, before gunicorn starts"""
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'], cwd=ROOT, env=env, check=True)
+
+
+def login(base, username):
+    """Sign up and log in, returning a Cookie header.
+
+    The session cookie is marked Secure, so it is forwarded by hand over plain HTTP.
+    """
+    requests.post(f"{base}/api/auth/signup", json={'username': username, 'email': f"{username}@bench.local", 'password': 'benchmark-pw'})
+    response = requests.post(f"{base}/api/auth/login", json={'username': username, 'password': 'benchmark-pw'})
+    response.raise_for_status()
+    return {'Cookie': f"session={response.cookies['session']}"}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--worker-class', default='gthread')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ai-concurrency', type=int, default=6, help='AI requests kept in flight')
+    parser.add_argument('--gemini-latency', type=float, default=2.0)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--port', type=int, default=8090)
+    args = parser.parse_args()
+
+    gemini_port = args.port + 1
+    base = f"http://127.0.0.1:{args.port}"
+    db_path = os.path.join(tempfile.mkdtemp(prefix='echobot-bench-'), 'bench.db')
+    env = dict(
+        os.environ,
+        PORT=str(args.port),
+        DATABASE_URL=f"sqlite:///{db_path}",
+        GEMINI_API_BASE=f"http://127.0.0.1:{gemini_port}/v1",
+        GEMINI_API_KEY='fake',
+        GUNICORN_WORKER_CLASS=args.worker_class,
+        WEB_CONCURRENCY=str(args.workers),
+        GUNICORN_THREADS=str(args.threads),
+    )
+    init_db(env)
+    procs = [
+        subprocess.Popen([sys.executable, os.path.join(ROOT, 'bench', 'fake_gemini.py'),
+                          '--port', str(gemini_port), '--latency', str(args.gemini_latency)]),
+        subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'], cwd=ROOT, env=env),
+    ]
+    try:
+        wait_for(f"{base}/login")
+        headers = login(base, 'bench_user')
+        stop = threading.Event()
+        ai_done = []
+
+        def ai_loop():
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    requests.post(f"{base}/api/ai/chat", json={'message': 'hello'}, headers=headers, timeout=60)
+                except requests.RequestException:
+                    continue
+                ai_done.append(time.perf_counter() - started)
+
+        ai_threads = [threading.Thread(target=ai_loop, daemon=True) for _ in range(args.ai_concurrency)]
+        for t in ai_threads:
+            t.start()
+        time.sleep(0.5)
+
+        cheap = {'/api/profile': [], '/api/chats': []}
+        deadline = time.time() + args.duration
+        while time.time() < deadline:
+            for path, samples in cheap.items():
+                started = time.perf_counter()
+                requests.get(f"{base}{path}", headers=headers, timeout=60).raise_for_status()
+                samples.append((time.perf_counter() - started) * 1000)
+        stop.set()
+
+        print(f"worker_class={args.worker_class} workers={args.workers} threads={args.threads} "
+              f"ai_in_flight={args.ai_concurrency} gemini_latency={args.gemini_latency}s")
+        for path, samples in cheap.items():
+            print(f"  {path:<14} n={len(samples):<5} p50={statistics.median(samples):8.1f}ms "
+                  f"p95={percentile(samples, 95):8.1f}ms max={max(samples):8.1f}ms")
+        print(f"  AI calls completed: {len(ai_done)}")
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Time OCR of sample images with and without preprocessing and banding.
+
+Generates a few typical uploads in a temp directory:
+  phone     - 12 MP JPEG photo of a page, uneven lighting, stored sideways with an EXIF rotation
+  scan      - 300 dpi letter-size PNG scan
+  scan-150  - the same page scanned at 150 dpi (scaled up to OCR_TARGET_DPI)
+  animated  - GIF with 6 frames, 3 of them distinct
+
+For each it times the original path (the raw image straight into Tesseract) against
+preprocessing plus banded OCR. Without a tesseract binary only preprocessing is timed:
+
+    python bench/ocr.py --threads 4
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+WORKDIR = tempfile.mkdtemp(prefix='echobot-bench-')
+os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}", UPLOAD_FOLDER=os.path.join(WORKDIR, 'uploads'))
+
+import app as echobot  # noqa: E402
+import pytesseract  # noqa: E402
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+LINES = [
+    'Quarterly report for the northern region, prepared for the board.',
+    'Revenue grew by 12 percent while operating costs stayed flat.',
+    'The warehouse expansion finished two weeks ahead of schedule.',
+    'Customer complaints fell for the third consecutive quarter.',
+]
+
+
+def page(width, height, font_size):
+    try:
+        font = ImageFont.load_default(size=font_size)
+    except TypeError:  # Pillow without FreeType support
+        font = ImageFont.load_default()
+    image = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    y, line = font_size * 3, 0
+    while y < height - font_size * 3:
+        draw.text((font_size * 3, y), LINES[line % len(LINES)], fill=20, font=font)
+        y, line = y + int(font_size * 1.6), line + 1
+    return image
+
+
+def make_samples():
+    samples = {}
+
+    photo = page(4032, 3024, 64).convert('RGB')
+    shading = Image.linear_gradient('L').resize(photo.size).point(lambda v: 40 + v // 3)
+    photo = Image.composite(Image.new('RGB', photo.size, (70, 60, 50)), photo, shading)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotate 90 degrees clockwise to view
+    samples['phone'] = os.path.join(WORKDIR, 'phone.jpg')
+    photo.transpose(Image.Transpose.ROTATE_90).save(samples['phone'], quality=90, exif=exif)
+
+    samples['scan'] = os.path.join(WORKDIR, 'scan.png')
+    page(2550, 3300, 42).save(samples['scan'], dpi=(300, 300))
+    samples['scan-150'] = os.path.join(WORKDIR, 'scan-150.png')
+    page(1275, 1650, 21).save(samples['scan-150'], dpi=(150, 150))
+
+    frames = [page(800, 300, 24), page(800, 300, 24), page(800, 300, 30), page(800, 300, 30), page(800, 300, 36), page(800, 300, 36)]
+    samples['animated'] = os.path.join(WORKDIR, 'animated.gif')
+    frames[0].save(samples['animated'], save_all=True, append_images=frames[1:], duration=500)
+    return samples
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=echobot.app.config['OCR_TILE_THREADS'])
+    parser.add_argument('--tile-pixels', type=int, default=echobot.app.config['OCR_TILE_PIXELS'])
+    args = parser.parse_args()
+    echobot.app.config.update(OCR_TILE_THREADS=args.threads, OCR_TILE_PIXELS=args.tile_pixels)
+
+    tesseract = shutil.which(pytesseract.pytesseract.tesseract_cmd) or shutil.which('tesseract')
+    if tesseract:
+        pytesseract.pytesseract.tesseract_cmd = echobot.app.config['TESSERACT_CMD'] = tesseract
+    else:
+        print('tesseract not found, timing preprocessing only')
+
+    print(f"OCR_TILE_THREADS={args.threads}, OCR_TILE_PIXELS={args.tile_pixels}")
+    print(f"  {'image':<10} {'size':>11} {'prepared':>11} {'bands':>5} {'prep':>7} {'old OCR':>8} {'new OCR':>8} {'chars old/new':>14}")
+    for name, path in make_samples().items():
+        with Image.open(path) as image:
+            size = f"{image.width}x{image.height}"
+            prepared, prep_time = timed(lambda: [echobot.prepare_ocr_image(frame) for frame in echobot.image_frames(image)])
+        bands = sum(len(echobot.ocr_band_boxes(p.width, p.height)) for p in prepared)
+        line = f"  {name:<10} {size:>11} {prepared[0].width}x{prepared[0].height:<6} {bands:>5} {prep_time:>6.2f}s"
+        if tesseract:
+            old_text, old_time = timed(lambda: pytesseract.image_to_string(Image.open(path)))
+            new_text, new_time = timed(lambda: echobot.extract_text_from_image_file(path))
+            line += f" {old_time:>7.2f}s {new_time:>7.2f}s {len(old_text.strip()):>6}/{len(new_text):<6}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
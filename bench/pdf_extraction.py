@@ -0,0 +1,107 @@
+"""Compare serial PDF text extraction with the page-sharded process pool path.
+
+Generates a synthetic text PDF with N pages, then times:
+  serial   - the original path: read the file into BytesIO and join every page in one process
+  sharded  - page ranges of PDF_PAGES_PER_TASK fanned out over a ProcessPoolExecutor
+
+    python bench/pdf_extraction.py --pages 300 --workers 4
+"""
+import argparse
+import io
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app import app, extract_pdf_page_range, pdf_page_ranges, count_pdf_pages, join_pdf_pages  # noqa: E402
+
+LOREM = ('Lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+         'incididunt ut labore et dolore magna aliqua Ut enim ad minim veniam quis nostrud').split()
+
+
+def write_text_pdf(path, page_count, lines_per_page=45):
+    """Write a minimal multi-page PDF whose pages carry real text objects"""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font = add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+    pages_ref = add(None)  # filled in once the page objects exist
+    kids = []
+    for number in range(page_count):
+        lines = [f'Page {number + 1} line {i}: ' + ' '.join(LOREM[(number + i) % 10:][:10]) for i in range(lines_per_page)]
+        ops = 'BT /F1 10 Tf 40 800 Td 12 TL ' + ' '.join(f'({line}) Tj T*' for line in lines) + ' ET'
+        stream = ops.encode('latin-1')
+        content = add(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        kids.append(add(b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] '
+                        b'/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>' % (pages_ref, font, content)))
+    objects[pages_ref - 1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % kid for kid in kids), len(kids))
+    catalog = add(b'<< /Type /Catalog /Pages %d 0 R >>' % pages_ref)
+
+    with open(path, 'wb') as out:
+        out.write(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(out.tell())
+            out.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+        xref = out.tell()
+        out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+        for offset in offsets:
+            out.write(b'%010d 00000 n \n' % offset)
+        out.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, catalog, xref))
+
+
+def serial_extract(path):
+    with open(path, 'rb') as f:
+        reader = PyPDF2.PdfReader(io.BytesIO(f.read()))
+    return '\n'.join([page.extract_text() or '' for page in reader.pages]).strip()
+
+
+def sharded_extract(path, workers):
+    app.config['EXTRACTION_WORKERS'] = workers
+    pages = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(extract_pdf_page_range, path, start, stop) for start, stop in pdf_page_ranges(count_pdf_pages(path))]
+        for future in futures:
+            pages.extend(future.result())
+    return join_pdf_pages(pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='echobot-bench-'), 'synthetic.pdf')
+    write_text_pdf(path, args.pages)
+    print(f"{args.pages} pages, {os.path.getsize(path) / 1024 / 1024:.1f} MB, {args.workers} workers, {os.cpu_count()} CPUs")
+
+    started = time.perf_counter()
+    serial_text = serial_extract(path)
+    serial_time = time.perf_counter() - started
+    serial_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # includes the app import
+
+    started = time.perf_counter()
+    sharded_text = sharded_extract(path, args.workers)
+    sharded_time = time.perf_counter() - started
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    assert serial_text == sharded_text, 'sharded extraction changed the text'
+    print(f"  serial   {serial_time:7.2f}s  peak RSS {serial_rss:7.1f} MB (single process)")
+    print(f"  sharded  {sharded_time:7.2f}s  peak RSS {child_rss:7.1f} MB (largest pool process)")
+    print(f"  speedup  {serial_time / sharded_time:7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Measure prompt size and /api/ai/chat latency with and without chunk retrieval.
+
+Uploads a generated PDF, then asks the same questions twice through the app's test client:
+  whole     - RETRIEVAL_CONTEXT_CHARS raised past the file size, so the full text is sent (old behaviour)
+  retrieval - the configured budget, so only the best BM25 chunks are sent
+
+The fake Gemini server charges --latency-per-kb per KB of prompt, like model prefill:
+
+    python bench/retrieval.py --pages 200
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+WORKDIR = tempfile.mkdtemp(prefix='echobot-bench-')
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}",
+    UPLOAD_FOLDER=os.path.join(WORKDIR, 'uploads'),
+    GEMINI_API_BASE='http://127.0.0.1:8093/v1',
+    GEMINI_API_KEY='fake',
+    AI_CACHE_BACKEND='none',
+    ASYNC_EXTRACTION='false',
+)
+
+from app import app, init_db  # noqa: E402
+from pdf_extraction import write_text_pdf  # noqa: E402
+
+with app.app_context():
+    init_db()
+
+QUESTIONS = [
+    'What does page 42 say about tempor incididunt?',
+    'Summarize the lines mentioning magna aliqua',
+    'Where is veniam quis nostrud discussed?',
+    'summarize this file',
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--latency-per-kb', type=float, default=0.002)
+    args = parser.parse_args()
+
+    fake = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'fake_gemini.py'), '--port', '8093',
+                             '--latency-per-kb', str(args.latency_per_kb)])
+    try:
+        time.sleep(0.5)
+        pdf_path = os.path.join(WORKDIR, 'document.pdf')
+        write_text_pdf(pdf_path, args.pages)
+
+        client = app.test_client()
+        client.environ_base['wsgi.url_scheme'] = 'https'
+        client.post('/api/auth/signup', json={'username': 'bench_user', 'email': 'bench@bench.local', 'password': 'benchmark-pw'})
+        client.post('/api/auth/login', json={'username': 'bench_user', 'password': 'benchmark-pw'})
+        with open(pdf_path, 'rb') as f:
+            file_id = client.post('/api/files', data={'file': (f, 'document.pdf')}).get_json()['file_id']
+
+        from app import build_ai_prompt
+        budget = app.config['RETRIEVAL_CONTEXT_CHARS']
+        print(f"{args.pages} pages, context budget {budget} chars, fake prefill {args.latency_per_kb * 1000:.1f} ms/KB")
+        for label, context_chars in (('whole', 10 ** 9), ('retrieval', budget)):
+            app.config['RETRIEVAL_CONTEXT_CHARS'] = context_chars
+            sizes, build_times, latencies = [], [], []
+            for question in QUESTIONS:
+                with app.test_request_context():
+                    started = time.perf_counter()
+                    sizes.append(len(build_ai_prompt(question, file_id, 1)))
+                    build_times.append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                client.post('/api/ai/chat', json={'message': question, 'file_id': file_id})
+                latencies.append((time.perf_counter() - started) * 1000)
+            print(f"  {label:<10} prompt {statistics.mean(sizes) / 1024:8.1f} KB  "
+                  f"build {statistics.mean(build_times):7.1f} ms  /api/ai/chat {statistics.mean(latencies):8.1f} ms")
+    finally:
+        fake.terminate()
+        fake.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Compare concurrent write throughput on SQLite with stock and tuned settings.
+
+Runs --workers processes (like gunicorn workers) with --threads writer threads each,
+all saving chats through POST /api/chat against one database file, while --readers
+threads per process page through GET /api/chats. Each mode gets a fresh database:
+  stock - rollback journal, synchronous=FULL, pysqlite's 5 s busy timeout, default caches
+  tuned - the app defaults: WAL, synchronous=NORMAL, busy_timeout, cache_size and mmap_size
+
+    python bench/sqlite_writes.py --workers 4 --threads 4 --duration 10
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(BENCH_DIR), BENCH_DIR]
+
+MODES = {
+    'stock': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'SQLITE_BUSY_TIMEOUT': '5000',
+              'SQLITE_CACHE_SIZE_MB': '2', 'SQLITE_MMAP_SIZE_MB': '0'},
+    'tuned': {},
+}
+
+
+def run_worker(env, number, args, results):
+    """One worker process: its own app import, engine and pool, like a gunicorn worker"""
+    os.environ.update(env)
+    import app as echobot
+    if number == 'setup':
+        with echobot.app.app_context():
+            echobot.init_db()
+
+    def client(username):
+        c = echobot.app.test_client()
+        c.environ_base['wsgi.url_scheme'] = 'https'
+        c.post('/api/auth/signup', json={'username': username, 'email': f'{username}@bench.local', 'password': 'benchmark-pw'})
+        c.post('/api/auth/login', json={'username': username, 'password': 'benchmark-pw'})
+        return c
+
+    writes, reads, errors = [], [], []
+    deadline = time.time() + args.duration
+
+    def writer(c):
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                status = c.post('/api/chat', json={'user_message': 'What changed in the report?', 'ai_message': 'Revenue grew. ' * 40}).status_code
+            except Exception as e:  # database is locked surfaces as an exception in the test client
+                status = type(e).__name__
+            (writes if status == 201 else errors).append((time.perf_counter() - started) * 1000)
+
+    def reader(c):
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = c.get('/api/chats', query_string={'per_page': 20, 'preview': 1}).status_code == 200
+            except Exception:
+                ok = False
+            (reads if ok else errors).append((time.perf_counter() - started) * 1000)
+
+    clients = [client(f'bench_{number}_{i}') for i in range(args.threads + args.readers)]
+    threads = [threading.Thread(target=writer, args=(c,)) for c in clients[:args.threads]]
+    threads += [threading.Thread(target=reader, args=(c,)) for c in clients[args.threads:]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    results.put((writes, reads, errors))
+
+
+def run_mode(name, args):
+    from load_test import percentile
+    workdir = tempfile.mkdtemp(prefix='echobot-bench-')
+    env = dict(MODES[name], DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+               UPLOAD_FOLDER=os.path.join(workdir, 'uploads'), AI_CACHE_BACKEND='none')
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+
+    # Create the schema once, as a deploy does, before the workers start
+    setup = ctx.Process(target=run_worker, args=(env, 'setup', argparse.Namespace(threads=0, readers=0, duration=0), results))
+    setup.start()
+    results.get()
+    setup.join()
+
+    procs = [ctx.Process(target=run_worker, args=(env, i, args, results)) for i in range(args.workers)]
+    for p in procs:
+        p.start()
+    writes, reads, errors = [], [], []
+    for _ in procs:
+        w, r, e = results.get()
+        writes += w
+        reads += r
+        errors += e
+    for p in procs:
+        p.join()
+
+    line = f"  {name:<6} {len(writes) / args.duration:>9.1f} {len(errors):>7}"
+    for samples in (writes, reads):
+        line += ''.join(f" {percentile(samples, pct):>8.1f}" if samples else f" {'-':>8}" for pct in (50, 95, 99))
+    line += f" {len(reads) / args.duration:>9.1f}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4, help='processes, like gunicorn workers')
+    parser.add_argument('--threads', type=int, default=4, help='writer threads per process')
+    parser.add_argument('--readers', type=int, default=2, help='reader threads per process')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--modes', default='stock,tuned')
+    args = parser.parse_args()
+
+    print(f"{args.workers} processes x ({args.threads} writers + {args.readers} readers), {args.duration:.0f}s per mode")
+    print(f"  {'mode':<6} {'writes/s':>9} {'errors':>7} {'w p50':>8} {'w p95':>8} {'w p99':>8} "
+          f"{'r p50':>8} {'r p95':>8} {'r p99':>8} {'reads/s':>9}")
+    for name in args.modes.split(','):
+        run_mode(name, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Check that a gunicorn worker's memory does not grow with upload size.
+
+Starts one gunicorn worker on a throwaway database, then streams PDF uploads of increasing
+size (one page plus a large unreferenced padding object) while sampling the worker's
+anonymous RSS. Mapped file pages are left out: they are page cache the kernel can drop,
+not worker memory. Exits non-zero if any upload raises the peak by more than --limit-mb
+over the small warm-up upload:
+
+    python bench/upload_memory.py --sizes 32,128,384
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import ROOT, init_db, login, wait_for  # noqa: E402
+
+
+def anon_rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError(f"no RssAnon for {pid}")
+
+
+def sample_peak(pid, stop, peaks):
+    while not stop.is_set():
+        peaks.append(anon_rss_mb(pid))
+        time.sleep(0.005)
+
+
+def worker_pid(master_pid):
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return int(f.read().split()[0])
+
+
+def write_multipart(path, size_mb, boundary):
+    """Write a multipart body holding a unique one-page PDF padded to size_mb"""
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        f.write(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="upload.pdf"\r\n'
+                f'Content-Type: application/pdf\r\n\r\n'.encode())
+        start = f.tell()
+        offsets = []
+
+        def add(body):
+            offsets.append(f.tell() - start)
+            f.write(f'{len(offsets)} 0 obj\n'.encode() + body + b'\nendobj\n')
+
+        f.write(b'%PDF-1.4\n')
+        add(b'<< /Type /Catalog /Pages 2 0 R >>')
+        add(b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>')
+        add(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>')
+        offsets.append(f.tell() - start)
+        f.write(f'4 0 obj\n<< /Length {size_mb * len(block) + 16} >>\nstream\n'.encode() + uuid.uuid4().bytes)
+        for _ in range(size_mb):
+            f.write(block)
+        f.write(b'\nendstream\nendobj\n')
+        xref = f.tell() - start
+        f.write(f'xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n'.encode())
+        f.write(''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode())
+        f.write(f'trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF'.encode())
+        f.write(f'\r\n--{boundary}--\r\n'.encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='32,128,384', help='upload sizes in MB, comma separated')
+    parser.add_argument('--limit-mb', type=float, default=48.0, help='allowed peak RSS growth per upload')
+    parser.add_argument('--port', type=int, default=8090)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='echobot-bench-')
+    base = f"http://127.0.0.1:{args.port}"
+    env = dict(
+        os.environ,
+        PORT=str(args.port),
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+        WEB_CONCURRENCY='1',
+        GUNICORN_TIMEOUT='300',
+    )
+    init_db(env)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'], cwd=ROOT, env=env)
+    failed = False
+    try:
+        wait_for(f"{base}/login", timeout=30)
+        headers = login(base, 'bench_user')
+        pid = worker_pid(server.pid)
+        boundary = uuid.uuid4().hex
+        headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+        body_path = os.path.join(workdir, 'body')
+
+        baseline = None
+        print(f"  {'upload':>8} {'time':>7} {'peak anon RSS':>14} {'growth':>8}")
+        for size_mb in [1] + [int(size) for size in args.sizes.split(',')]:
+            write_multipart(body_path, size_mb, boundary)
+            stop, peaks = threading.Event(), []
+            sampler = threading.Thread(target=sample_peak, args=(pid, stop, peaks))
+            sampler.start()
+            started = time.perf_counter()
+            with open(body_path, 'rb') as body:
+                response = requests.post(f"{base}/api/files", data=body, headers=headers, timeout=300)
+            elapsed = time.perf_counter() - started
+            time.sleep(0.5)
+            stop.set()
+            sampler.join()
+            response.raise_for_status()
+            peak = max(peaks)
+            if baseline is None:
+                baseline = peak
+                print(f"  {size_mb:>5} MB {elapsed:>6.2f}s {peak:>11.1f} MB  (warm-up)")
+                continue
+            growth = peak - baseline
+            failed = failed or growth > args.limit_mb
+            print(f"  {size_mb:>5} MB {elapsed:>6.2f}s {peak:>11.1f} MB {growth:>+6.1f} MB")
+    finally:
+        server.terminate()
+        server.wait()
+
+    if failed:
+        print(f"FAIL: peak anonymous RSS grew by more than {args.limit_mb} MB for an upload")
+        sys.exit(1)
+    print(f"OK: peak anonymous RSS stayed within {args.limit_mb} MB of the warm-up upload")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Exercise the Gemini client's retries, circuit breaker and in-flight limits against injected faults.
+
+Imports the app on a throwaway database and drives /api/ai/chat from threads while
+bench/fake_gemini.py misbehaves. Each scenario runs twice, with the resilience settings
+off (no retries, no breaker, no limits) and with the app defaults:
+  flaky     - 30% of answers are 503
+  throttled - 50% of answers are 429 with Retry-After: 1
+  outage    - every answer is 503 for the first --outage seconds, then the upstream recovers
+  noisy     - one user keeps 12 requests in flight while another sends one at a time
+
+    python bench/upstream_faults.py --duration 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(BENCH_DIR), BENCH_DIR]
+WORKDIR = tempfile.mkdtemp(prefix='echobot-bench-')
+os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}", UPLOAD_FOLDER=os.path.join(WORKDIR, 'uploads'),
+                  AI_CACHE_BACKEND='none', GEMINI_API_KEY='fake')
+
+import app as echobot  # noqa: E402
+import prometheus_client  # noqa: E402
+from load_test import percentile, wait_for  # noqa: E402
+
+OFF = {'GEMINI_MAX_RETRIES': 0, 'GEMINI_BREAKER_THRESHOLD': 0, 'GEMINI_MAX_CONCURRENCY': 1000, 'GEMINI_USER_CONCURRENCY': 1000}
+ON = {key: echobot.app.config[key] for key in OFF}
+
+
+def configure(settings, port):
+    echobot.app.config.update(settings, GEMINI_API_BASE=f"http://127.0.0.1:{port}/v1")
+    echobot.gemini_breaker = echobot.CircuitBreaker(settings['GEMINI_BREAKER_THRESHOLD'], settings['GEMINI_BREAKER_COOLDOWN'])
+    echobot.gemini_limiter = echobot.InFlightLimiter(settings['GEMINI_MAX_CONCURRENCY'], settings['GEMINI_USER_CONCURRENCY'],
+                                                     echobot.app.config['GEMINI_QUEUE_TIMEOUT'])
+
+
+def upstream_calls():
+    return sum(sample.value for metric in prometheus_client.REGISTRY.collect() if metric.name == 'echobot_gemini_responses'
+               for sample in metric.samples if sample.name == 'echobot_gemini_responses_total')
+
+
+def client(username):
+    c = echobot.app.test_client()
+    c.environ_base['wsgi.url_scheme'] = 'https'
+    c.post('/api/auth/signup', json={'username': username, 'email': f'{username}@bench.local', 'password': 'benchmark-pw'})
+    c.post('/api/auth/login', json={'username': username, 'password': 'benchmark-pw'})
+    return c
+
+
+def drive(users, duration):
+    """users: {username: threads}. Returns {username: [(ms, status)]}"""
+    results = {username: [] for username in users}
+    deadline = time.time() + duration
+
+    def loop(c, samples):
+        while time.time() < deadline:
+            started = time.perf_counter()
+            status = c.post('/api/ai/chat', json={'message': f'Summarize report {uuid.uuid4().hex}'}).status_code
+            samples.append(((time.perf_counter() - started) * 1000, status))
+
+    threads = []
+    for username, count in users.items():
+        for _ in range(count):
+            threads.append(threading.Thread(target=loop, args=(client(username), results[username])))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def report(label, samples, calls, duration):
+    ok = [ms for ms, status in samples if status == 200]
+    statuses = {}
+    for _, status in samples:
+        statuses[status] = statuses.get(status, 0) + 1
+    line = f"  {label:<18} {len(samples):>6} {len(ok) / max(1, len(samples)):>7.0%} {calls / duration:>10.1f}"
+    line += ''.join(f" {percentile([ms for ms, _ in samples], pct):>8.0f}" for pct in (50, 95))
+    print(line + '  ' + ' '.join(f"{status}x{count}" for status, count in sorted(statuses.items())))
+
+
+SCENARIOS = {
+    'flaky': (['--error-rate', '0.3', '--error-status', '503'], {'alice': 4}),
+    'throttled': (['--error-rate', '0.5', '--error-status', '429', '--retry-after', '1'], {'alice': 4}),
+    'outage': (None, {'alice': 4}),
+    'noisy': ([], {'noisy': 12, 'quiet': 1}),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--latency', type=float, default=0.2, help='fake Gemini seconds per answer')
+    parser.add_argument('--outage', type=float, default=5.0, help='seconds the upstream is down in the outage scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--port', type=int, default=8095)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--cooldown', type=float, default=2.0, help='GEMINI_BREAKER_COOLDOWN for the runs with it on')
+    args = parser.parse_args()
+    ON['GEMINI_BREAKER_COOLDOWN'] = OFF['GEMINI_BREAKER_COOLDOWN'] = args.cooldown
+
+    with echobot.app.app_context():
+        echobot.init_db()
+
+    print(f"{args.duration:.0f}s per run, fake Gemini latency {args.latency}s")
+    print(f"  {'run':<18} {'reqs':>6} {'ok':>7} {'upstream/s':>10} {'p50 ms':>8} {'p95 ms':>8}  statuses")
+    for name in args.scenarios.split(','):
+        faults, users = SCENARIOS[name]
+        if faults is None:
+            faults = ['--outage', f'0:{args.outage}']
+        for mode, settings in (('off', OFF), ('on', ON)):
+            fake = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'fake_gemini.py'), '--port', str(args.port),
+                                     '--latency', str(args.latency), '--seed', str(args.seed)] + faults, stdout=subprocess.DEVNULL)
+            try:
+                wait_for(f"http://127.0.0.1:{args.port}/v1")
+                configure(settings, args.port)
+                calls = upstream_calls()
+                results = drive(users, args.duration)
+                calls = upstream_calls() - calls
+            finally:
+                fake.terminate()
+                fake.wait()
+            for username, samples in results.items():
+                label = f"{name}/{mode}" + (f" {username}" if len(results) > 1 else '')
+                report(label, samples, calls, args.duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+#!/usr/bin/env bash
+# Build step for platforms that run a build command (e.g. Render: ./build.sh)
+set -o errexit
+
+pip install -r requirements.txt
+# Create or upgrade the schema once here instead of in every worker as it boots
+flask --app app init-db
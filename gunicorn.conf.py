@@ -0,0 +1,47 @@
+# Gunicorn settings for EchoBot (used by the Procfile: `gunicorn -c gunicorn.conf.py app:app`)
+#
+# AI requests spend most of their time waiting on Gemini, so the default sync worker
+# (one request per process) lets a few slow completions block every route. Threaded
+# workers keep serving cheap routes like /api/profile while AI calls are in flight.
+#
+# Sizing: workers ~= CPU cores (2 on a basic dyno); threads = concurrent requests per
+# worker, mostly I/O bound. Total concurrency = workers * threads. GEMINI_POOL_SIZE
+# defaults to GUNICORN_THREADS so every thread can hold a keep-alive connection.
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# Must exceed GEMINI_TIMEOUT so a streamed answer is never cut off by the worker timeout
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# Import the app once in the master and fork workers from it: quicker worker boots and restarts.
+# app.py drops database and Gemini connections in each forked child.
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'false').lower() == 'true'
+# Recycle a worker after this many requests (0 never), with jitter so they don't all restart at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+# Workers write metric samples here so /metrics reports totals for the whole server.
+# Set before the workers import the app; emptied on every start so old PIDs don't linger.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'echobot-metrics'))
+# With preload_app the master imports the app, and creates its metrics, before on_starting runs
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+# Imported here, after the variable is set (prometheus_client picks its value class when imported),
+# and not inside child_exit: gunicorn runs that hook from its SIGCHLD handler, which can interrupt
+# a lazy import half way through and crash the master.
+from prometheus_client import multiprocess  # noqa: E402
+
+
+def on_starting(server):
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,11 @@
+// Avatar markup: resized WebP/JPEG thumbnails through srcset once the server has made them,
+// the uploaded image until then. `displaySize` is the rendered width in CSS pixels.
+function avatarImage(userData, displaySize) {
+  const srcset = userData.avatar_srcset;
+  if (!srcset) {
+    return `<img src="${userData.avatar}" alt="User Avatar" class="avatar-image">`;
+  }
+  const sizes = `${displaySize}px`;
+  return `<picture><source type="image/webp" srcset="${srcset.webp}" sizes="${sizes}">` +
+    `<img src="${userData.avatar}" srcset="${srcset.jpeg}" sizes="${sizes}" alt="User Avatar" class="avatar-image"></picture>`;
+}
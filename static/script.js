@@ -6,6 +6,10 @@ class EchoBot {
     this.isTyping = false;
     this.currentUser = null;
     this.activeChatId = null;
+    this.conversationId = null;
+    this.chatHistory = [];
+    this.nextChatCursor = null;
+    this.loadingMoreChats = false;
     this.initElements();
     this.initEventListeners();
     this.initializeUser();
@@ -33,6 +37,14 @@ class EchoBot {
   }
 
   initEventListeners() {
+    // Load older chats as the sidebar is scrolled near its end
+    const sidebar = this.elements.chatHistoryContainer?.closest('.sidebar');
+    sidebar?.addEventListener('scroll', () => {
+      if (sidebar.scrollTop + sidebar.clientHeight >= sidebar.scrollHeight - 200) {
+        this.loadMoreChatHistory();
+      }
+    });
+
     // Desktop user avatar dropdown
     const desktopAvatar = document.getElementById('desktop-user-avatar');
     const desktopDropdown = document.getElementById('user-dropdown-menu');
@@ -158,8 +170,8 @@ class EchoBot {
       
       if (userData.avatar && userData.avatar !== '/static/Avatar.jpeg') {
         // User has custom avatar
-        desktopAvatar.innerHTML = `<img src="${userData.avatar}" alt="User Avatar" class="avatar-image">`;
-        mobileAvatar.innerHTML = `<img src="${userData.avatar}" alt="User Avatar" class="avatar-image">`;
+        desktopAvatar.innerHTML = avatarImage(userData, 40);
+        mobileAvatar.innerHTML = avatarImage(userData, 40);
       } else {
         // Use initials
         const initials = userData.username.substring(0, 2).toUpperCase();
@@ -176,10 +188,12 @@ class EchoBot {
 
   async loadChatHistory() {
     try {
-      const response = await fetch('/api/chats', { credentials: 'include' });
+      const response = await fetch('/api/chats?preview=1', { credentials: 'include' });
       if (response.status === 200) {
         const data = await response.json();
         const chats = data.chats || [];
+        this.chatHistory = chats;
+        this.nextChatCursor = data.next_cursor || null;
 
         this.organizeAndDisplayChatHistory(chats);
 
@@ -198,6 +212,25 @@ class EchoBot {
     }
   }
 
+  // Fetch the next page of the sidebar with the keyset cursor from the last page
+  async loadMoreChatHistory() {
+    if (!this.nextChatCursor || this.loadingMoreChats) return;
+    this.loadingMoreChats = true;
+    try {
+      const response = await fetch(`/api/chats?preview=1&before=${encodeURIComponent(this.nextChatCursor)}`, { credentials: 'include' });
+      if (response.status === 200) {
+        const data = await response.json();
+        this.chatHistory = this.chatHistory.concat(data.chats || []);
+        this.nextChatCursor = data.next_cursor || null;
+        this.organizeAndDisplayChatHistory(this.chatHistory);
+      }
+    } catch (err) {
+      console.error('Failed to load more chat history:', err);
+    } finally {
+      this.loadingMoreChats = false;
+    }
+  }
+
   organizeAndDisplayChatHistory(chats) {
     if (!chats || chats.length === 0) {
       this.elements.chatHistoryContainer.innerHTML = '<p style="color: var(--text-secondary); text-align: center; margin: 1rem 0;">No chat history yet.</p>';
@@ -298,9 +331,12 @@ class EchoBot {
     try {
       this.isTyping = true;
       this.showTypingIndicator(true);
-      const aiResponse = await this.getAIResponse(inputText);
-      this.showTypingIndicator(false);
-      this.renderMessage(aiResponse, 'ai');
+      const streamed = await this.streamAIResponse(inputText);
+      if (!streamed) {
+        const aiResponse = await this.getAIResponse(inputText);
+        this.showTypingIndicator(false);
+        this.renderMessage(aiResponse, 'ai');
+      }
       // Chat is already saved in getAIResponse, so refresh chat history
       await this.loadChatHistory();
     } catch (error) {
@@ -313,6 +349,89 @@ class EchoBot {
     }
   }
 
+  // Render tokens as they arrive from /api/ai/chat/stream.
+  // Returns false if nothing was streamed so the caller can fall back to /api/ai/chat.
+  async streamAIResponse(userText) {
+    let response;
+    try {
+      response = await fetch('/api/ai/chat/stream', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Accept': 'text/event-stream'
+        },
+        credentials: 'include',
+        body: JSON.stringify({
+          message: userText,
+          file_id: this.activeFileId,
+          conversation_id: this.conversationId
+        })
+      });
+    } catch (error) {
+      console.error('Streaming request failed:', error);
+      return false;
+    }
+
+    if (!response.ok || !response.body) {
+      return false;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let messageContent = null;
+    let text = '';
+
+    const appendText = (chunk) => {
+      if (!messageContent) {
+        this.showTypingIndicator(false);
+        messageContent = this.renderMessage('', 'ai');
+      }
+      text += chunk;
+      messageContent.textContent = text;
+      this.scrollToBottom();
+    };
+
+    try {
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const rawEvent = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+
+          let eventName = 'message';
+          let data = '';
+          rawEvent.split('\n').forEach(line => {
+            if (line.startsWith('event:')) eventName = line.slice(6).trim();
+            else if (line.startsWith('data:')) data += line.slice(5).trim();
+          });
+          if (!data) continue;
+          const payload = JSON.parse(data);
+
+          if (eventName === 'token') {
+            appendText(payload.text);
+          } else if (eventName === 'done') {
+            this.activeChatId = payload.chat_id;
+            this.conversationId = payload.conversation_id;
+            if (!messageContent) appendText(payload.response);
+          } else if (eventName === 'error') {
+            appendText(`${text ? '\n\n' : ''}I apologize, but I'm having trouble connecting to the AI service: ${payload.error}`);
+          }
+        }
+      }
+    } catch (error) {
+      console.error('Error reading AI stream:', error);
+      if (!messageContent) return false;
+    }
+
+    this.showTypingIndicator(false);
+    return messageContent !== null;
+  }
+
   async getAIResponse(userText) {
     try {
       const response = await fetch('/api/ai/chat', {
@@ -323,7 +442,8 @@ class EchoBot {
         credentials: 'include',
         body: JSON.stringify({
           message: userText,
-          file_id: this.activeFileId
+          file_id: this.activeFileId,
+          conversation_id: this.conversationId
         })
       });
 
@@ -333,6 +453,7 @@ class EchoBot {
       }
 
       const data = await response.json();
+      this.conversationId = data.conversation_id || this.conversationId;
       return data.response || 'Sorry, I could not generate a response.';
     } catch (error) {
       console.error('Error getting AI response:', error);
@@ -398,6 +519,17 @@ class EchoBot {
       }
 
       const data = await response.json();
+      let status = data.status;
+      if (status === 'pending') {
+        this.renderMessage(`⏳ File "${data.filename}" uploaded. Extracting text...`, 'ai');
+        status = await this.waitForFileProcessing(data.file_id);
+      }
+      if (status === 'pending') {
+        throw new Error('Text extraction is taking too long. Please try again later.');
+      }
+      if (status !== 'ready') {
+        throw new Error('Text extraction failed for this file.');
+      }
       this.activeFileId = data.file_id;
       this.updateActiveFileUI(data.filename);
       this.renderMessage(`📄 File "${data.filename}" uploaded successfully. You can now ask questions about it.`, 'ai');
@@ -414,6 +546,20 @@ class EchoBot {
   }
 
 
+  // Poll the upload's extraction status until the background job finishes or timeoutMs passes
+  async waitForFileProcessing(fileId, intervalMs = 1500, timeoutMs = 5 * 60 * 1000) {
+    const deadline = Date.now() + timeoutMs;
+    while (true) {
+      const response = await fetch(`/api/files/${fileId}/status`, { credentials: 'include' });
+      if (!response.ok) {
+        throw new Error(`Status check failed with status ${response.status}`);
+      }
+      const { status } = await response.json();
+      if (status !== 'pending' || Date.now() + intervalMs > deadline) return status;
+      await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+  }
+
   updateActiveFileUI(filename) {
     const indicator = this.elements.activeFileIndicator;
     const nameSpan = document.getElementById('active-file-name');
@@ -439,7 +585,7 @@ class EchoBot {
     if (sender === 'user') {
       // Use user's avatar or initials
       if (this.currentUser && this.currentUser.avatar && this.currentUser.avatar !== '/static/Avatar.jpeg') {
-        avatarDiv.innerHTML = `<img src="${this.currentUser.avatar}" alt="User Avatar" class="avatar-image">`;
+        avatarDiv.innerHTML = avatarImage(this.currentUser, 40);
       } else {
         const initials = this.currentUser && this.currentUser.username ? 
           this.currentUser.username.substring(0, 2).toUpperCase() : 'U';
@@ -471,6 +617,7 @@ class EchoBot {
 
     this.elements.messages.appendChild(messageDiv);
     this.scrollToBottom();
+    return messageContent;
   }
 
   showTypingIndicator(show) {
@@ -501,6 +648,8 @@ class EchoBot {
       const response = await fetch(`/api/chats/${chatId}`, { credentials: 'include' });
       if (response.ok) {
         const chat = await response.json();
+        // Further messages continue this chat's conversation
+        this.conversationId = chat.conversation_id || null;
         this.elements.messages.innerHTML = '';
         this.renderMessage(chat.user_message, 'user', new Date(chat.timestamp).toLocaleString());
         this.renderMessage(chat.ai_message, 'ai', new Date(chat.timestamp).toLocaleString());
@@ -520,6 +669,7 @@ class EchoBot {
     `;
     this.activeFileId = null;
     this.activeChatId = null;
+    this.conversationId = null;
     this.elements.activeFileIndicator.style.display = 'none';
     this.elements.userInput.focus();
 
@@ -529,29 +679,16 @@ class EchoBot {
     });
   }
 
-  async exportChatHistory() {
-    try {
-      const response = await fetch('/api/chats/export', { credentials: 'include' });
-      if (response.ok) {
-        const data = await response.json();
-        const blob = new Blob([JSON.stringify(data, null, 2)], { type: 'application/json' });
-        const url = window.URL.createObjectURL(blob);
-        const a = document.createElement('a');
-        a.href = url;
-        a.download = `echobot-chat-history-${new Date().toISOString().split('T')[0]}.json`;
-        document.body.appendChild(a);
-        a.click();
-        document.body.removeChild(a);
-        window.URL.revokeObjectURL(url);
-
-        this.renderMessage('Chat history exported successfully!', 'ai');
-      } else {
-        throw new Error(await response.text());
-      }
-    } catch (error) {
-      console.error('Export failed:', error);
-      this.renderMessage(`Export failed: ${error.message}`, 'ai');
-    }
+  exportChatHistory() {
+    // Let the browser stream the download instead of buffering the whole history in JS
+    const a = document.createElement('a');
+    a.href = '/api/chats/export?format=json';
+    a.download = `echobot-chat-history-${new Date().toISOString().split('T')[0]}.json`;
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
+
+    this.renderMessage('Chat history export started.', 'ai');
   }
 
   startVoiceRecognition() {
@@ -720,8 +857,8 @@ async function searchChatHistory(query) {
     });
 
     if (response.ok) {
-      const results = await response.json();
-      displaySearchResults(results);
+      const data = await response.json();
+      displaySearchResults(data.results);
     } else {
       performClientSideSearch(query);
     }
@@ -756,9 +893,11 @@ function displaySearchResults(results) {
     return;
   }
 
+  // Server snippets are already HTML-escaped, with matches wrapped in <mark>
   const resultsHTML = results.map(result => `
     <div class="search-result-item" data-chat-id="${result.id}" onclick="loadSearchResult('${result.id}')">
-      <h4>${result.user_message.substring(0, 100)}${result.user_message.length > 100 ? '...' : ''}</h4>
+      <h4>${result.user_snippet || (result.user_message.substring(0, 100) + (result.user_message.length > 100 ? '...' : ''))}</h4>
+      ${result.ai_snippet ? `<p class="search-result-snippet">${result.ai_snippet}</p>` : ''}
       <p>${new Date(result.timestamp).toLocaleDateString()}</p>
     </div>
   `).join('');
@@ -0,0 +1,283 @@
+"""Tests for the Gemini client, the streaming route and a few helpers, against bench/fake_gemini.py.
+
+    pip install pytest
+    python -m pytest
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'bench')]
+WORKDIR = tempfile.mkdtemp(prefix='echobot-test-')
+os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(WORKDIR, 'test.db')}", UPLOAD_FOLDER=os.path.join(WORKDIR, 'uploads'),
+                  AI_CACHE_BACKEND='none', GEMINI_API_KEY='fake')
+os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+import app as echobot  # noqa: E402
+from fake_gemini import make_handler  # noqa: E402
+
+with echobot.app.app_context():
+    echobot.init_db()
+
+
+@pytest.fixture(autouse=True)
+def gemini_settings(monkeypatch):
+    """Fast retries and a fresh breaker and limiter for every test"""
+    settings = {'GEMINI_MAX_RETRIES': 2, 'GEMINI_RETRY_BASE': 0.01, 'GEMINI_RETRY_MAX_DELAY': 1.0,
+                'GEMINI_BREAKER_THRESHOLD': 2, 'GEMINI_BREAKER_COOLDOWN': 0.3}
+    for key, value in settings.items():
+        monkeypatch.setitem(echobot.app.config, key, value)
+    monkeypatch.setattr(echobot, 'gemini_breaker', echobot.CircuitBreaker(2, 0.3))
+    monkeypatch.setattr(echobot, 'gemini_limiter', echobot.InFlightLimiter(2, 1, 0.1))
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    """Start a fake Gemini with the given faults; returns the list of request paths it received"""
+    servers = []
+
+    def start(**faults):
+        calls = []
+        handler = make_handler(faults.pop('latency', 0.0), faults.pop('chunks', 4), 0.0, **faults)
+
+        class CountingHandler(handler):
+            def do_POST(self):
+                calls.append(self.path)
+                super().do_POST()
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        monkeypatch.setitem(echobot.app.config, 'GEMINI_API_BASE', f"http://127.0.0.1:{server.server_address[1]}/v1")
+        return calls
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def client():
+    username = f"u{uuid.uuid4().hex[:12]}"
+    c = echobot.app.test_client()
+    c.environ_base['wsgi.url_scheme'] = 'https'
+    c.post('/api/auth/signup', json={'username': username, 'email': f'{username}@test.local', 'password': 'password1'})
+    assert c.post('/api/auth/login', json={'username': username, 'password': 'password1'}).status_code == 200
+    with echobot.app.app_context():
+        c.user_id = echobot.User.query.filter_by(username=username).one().id
+    return c
+
+
+def ask(contents='hello'):
+    with echobot.app.app_context():
+        return echobot.generate_ai_response([echobot.gemini_turn('user', contents)], 'fake')
+
+
+def sse_events(body):
+    events = []
+    for block in body.decode('utf-8').strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+# ========== RETRIES ==========
+def test_retry_after_is_honoured_before_retrying(fake_gemini):
+    calls = fake_gemini(outage=(0, 0.2), retry_after='0.3')
+    started = time.monotonic()
+    assert ask('hi there') == 'Echo: hi there'
+    assert len(calls) == 2
+    assert time.monotonic() - started >= 0.3
+
+
+def test_retries_run_out(fake_gemini):
+    calls = fake_gemini(error_rate=1.0, error_status=503)
+    with pytest.raises(echobot.GeminiUnavailable) as raised:
+        ask()
+    assert raised.value.status == 503
+    assert len(calls) == 3  # the call and GEMINI_MAX_RETRIES retries
+
+
+def test_retry_after_beyond_max_delay_is_not_waited_for(fake_gemini):
+    calls = fake_gemini(error_rate=1.0, error_status=429, retry_after='60')
+    with pytest.raises(echobot.GeminiUnavailable) as raised:
+        ask()
+    assert len(calls) == 1
+    assert raised.value.retry_after == 60
+
+
+def test_client_errors_are_not_retried(fake_gemini):
+    calls = fake_gemini(error_rate=1.0, error_status=400)
+    with pytest.raises(echobot.GeminiUnavailable):
+        ask()
+    assert len(calls) == 1
+    assert echobot.gemini_breaker.retry_after() == 0
+
+
+def test_retry_after_seconds():
+    def header(value):
+        return SimpleNamespace(headers={'Retry-After': value} if value is not None else {})
+
+    assert echobot.retry_after_seconds(header('2')) == 2
+    assert echobot.retry_after_seconds(header('-5')) == 0
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < echobot.retry_after_seconds(header(later)) <= 30
+    assert echobot.retry_after_seconds(header('soon')) is None
+    assert echobot.retry_after_seconds(header(None)) is None
+
+
+# ========== CIRCUIT BREAKER ==========
+def test_breaker_opens_then_lets_a_trial_call_through(fake_gemini, monkeypatch):
+    monkeypatch.setitem(echobot.app.config, 'GEMINI_MAX_RETRIES', 0)
+    calls = fake_gemini(outage=(0, 0.25))
+    for _ in range(2):
+        with pytest.raises(echobot.GeminiUnavailable):
+            ask()
+    # Open: fails fast without reaching the upstream
+    with pytest.raises(echobot.GeminiUnavailable) as raised:
+        ask()
+    assert raised.value.status == 'circuit open' and raised.value.retry_after > 0
+    assert len(calls) == 2
+
+    time.sleep(0.35)  # past the cooldown and the outage
+    assert ask('back') == 'Echo: back'
+    assert len(calls) == 3
+    assert echobot.gemini_breaker.retry_after() == 0
+
+
+def test_half_open_breaker_allows_one_trial_and_reopens_when_it_fails():
+    breaker = echobot.CircuitBreaker(threshold=1, cooldown=0.05)
+    breaker.record(False)
+    assert breaker.retry_after() > 0
+    time.sleep(0.06)
+    assert breaker.retry_after() == 0  # the trial call
+    assert breaker.retry_after() > 0  # everyone else waits for it
+    breaker.record(False)
+    assert breaker.retry_after() > 0.04
+
+
+# ========== IN-FLIGHT LIMITS ==========
+def test_user_limit_is_429_and_global_limit_is_503(fake_gemini, client):
+    calls = fake_gemini()
+    limiter = echobot.gemini_limiter  # 2 in flight per worker, 1 per user
+    limiter.acquire(client.user_id)
+    try:
+        response = client.post('/api/ai/chat', json={'message': 'over my limit'})
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '1'
+    finally:
+        limiter.release(client.user_id)
+
+    limiter.acquire('someone')
+    limiter.acquire('someone else')
+    try:
+        response = client.post('/api/ai/chat', json={'message': 'worker is full'})
+        assert response.status_code == 503
+    finally:
+        limiter.release('someone')
+        limiter.release('someone else')
+    assert calls == []
+
+    assert client.post('/api/ai/chat', json={'message': 'room now'}).status_code == 200
+
+
+# ========== STREAMING ==========
+def test_streamed_answer_is_saved_as_a_chat(fake_gemini, client):
+    calls = fake_gemini(chunks=4)
+    response = client.post('/api/ai/chat/stream', json={'message': 'tell me a long story please'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = sse_events(response.data)
+    tokens = [data['text'] for event, data in events if event == 'token']
+    assert len(tokens) > 1
+    assert ':streamGenerateContent' in calls[0]
+
+    event, done = events[-1]
+    assert event == 'done'
+    with echobot.app.app_context():
+        chat = echobot.db.session.get(echobot.Chat, done['chat_id'])
+        assert chat.user_id == client.user_id
+        assert chat.user_message == 'tell me a long story please'
+        assert chat.ai_message == ''.join(tokens).strip() == 'Echo: tell me a long story please'
+
+
+def test_failed_stream_sends_an_error_event_and_saves_nothing(fake_gemini, client):
+    fake_gemini(error_rate=1.0, error_status=503)
+    response = client.post('/api/ai/chat/stream', json={'message': 'anyone there?'})
+    assert [event for event, _ in sse_events(response.data)] == ['error']
+    with echobot.app.app_context():
+        assert not echobot.Chat.query.filter_by(user_id=client.user_id).count()
+
+
+# ========== HELPERS ==========
+def test_singleflight_shares_one_call_and_not_unshared_errors():
+    flight = echobot.SingleFlight()
+    release = threading.Event()
+    results = []
+
+    def slow():
+        release.wait(1)
+        return 'answer'
+
+    def follow():
+        results.append(flight.do('key', lambda: 'second call'))
+
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+    leader.start()
+    time.sleep(0.05)
+    follower = threading.Thread(target=follow)
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join()
+    follower.join()
+    assert sorted(results) == [('answer', False), ('answer', True)]
+
+    def busy():
+        release.wait(1)
+        raise echobot.GeminiBusy('user')
+
+    def lead_busy():
+        try:
+            flight.do('key', busy, unshared=(echobot.GeminiBusy,))
+        except echobot.GeminiBusy:
+            results.append('leader busy')
+
+    release.clear()
+    results.clear()
+    leader = threading.Thread(target=lead_busy)
+    leader.start()
+    time.sleep(0.05)
+    follower = threading.Thread(target=lambda: results.append(flight.do('key', lambda: 'own call', unshared=(echobot.GeminiBusy,))))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join()
+    follower.join()
+    assert sorted(results, key=str) == [('own call', False), 'leader busy']
+
+
+def test_chat_cursor_round_trip():
+    chat = SimpleNamespace(timestamp=datetime(2024, 5, 1, 12, 30, 15, 123456), id=42)
+    assert echobot.parse_chat_cursor(echobot.chat_cursor(chat)) == (chat.timestamp, 42)
+    for malformed in ('', 'yesterday,1', '2024-05-01T12:30:15,abc'):
+        with pytest.raises(ValueError):
+            echobot.parse_chat_cursor(malformed)
+
+
+def test_merge_band_text_drops_lines_repeated_in_the_overlap():
+    bands = ['first line\nsecond line\nthird line', 'second line\nthird line\nfourth line', 'fifth line']
+    assert echobot.merge_band_text(bands) == 'first line\nsecond line\nthird line\nfourth line\nfifth line'
+    assert echobot.merge_band_text(['same\n', 'other']) == 'same\nother'